@@ -0,0 +1,675 @@
+"""
+Constraint Solver
+    Shared engine under the sudoku and kenken solvers
+    A puzzle is cells that each hold a number 1 to maxValue, plus rules over groups of cells
+
+Pieces
+1. Model
+    numbers and possible bitmasks for every cell, and the list of rules
+2. Rules
+    AllDifferent - no repeats, rows, columns, sudoku blocks
+    Cage - op and result over cells, kenken blocks and killer sudoku cages
+      Keeps a list of every tuple that does the math
+3. Propagation
+    Queue of rules to recheck, a rule goes back on when one of its cells changes
+4. Search, pick one with Model.solve
+    playerSolver - propagate, then guess on the cell with the fewest options
+    backtrack - fill a cell at a time, only checking against filled cells
+    backjump - backtrack that jumps back to the cell to blame and learns nogoods,
+               cuts nodes with the plain index order, the cage order leaves it little to skip
+5. ExactCover
+    Dancing links, for puzzles that can be written as exact cover like kenken's dlx
+"""
+
+from array import array
+from functools import reduce, lru_cache
+from collections import OrderedDict, deque
+
+
+class Contradiction(Exception):
+    """A cell or rule ran out of options, guessed wrong somewhere"""
+
+
+# Possible numbers are bitmasks, bit n set means n can go in the cell
+maskNumbers = [tuple(n for n in range(1, 10) if m >> n & 1) for m in range(1 << 10)]
+
+def numbersIn(mask):
+    """Numbers set in a possible mask"""
+    if mask < len(maskNumbers):
+        return maskNumbers[mask]
+    return tuple(n for n in range(1, mask.bit_length()) if mask >> n & 1)
+
+def blockMath(op, result, vals):
+    """Test a full list of numbers against a block's math
+
+    - and ÷ take the largest number and subtract or divide out all the others,
+    the usual 2 cell rule generalized for bigger blocks.
+    = or no op is a given number, 1 cell holding result"""
+    if op == '+':
+        return sum(vals) == result
+    elif op in ['*', 'x', '×']:
+        prod = reduce(lambda x,y: x*y, vals)
+        return prod == result
+    elif op in ['', '=']:
+        return len(vals) == 1 and vals[0] == result
+    # Max value first for - or ÷
+    vals = sorted(vals, reverse=True)
+    if op in ['/', '÷']:
+        return vals[0] == result * reduce(lambda x,y: x*y, vals[1:], 1)
+    elif op in ['-', '−']:
+        return vals[0] - sum(vals[1:]) == result
+    else:
+        raise RuntimeError("Missing operation for a KenKen block")
+
+@lru_cache(maxsize=4096)
+def findTuples(op, result, maxValue, clashes):
+    """List every fill of a block's cells that does the math
+
+    clashes[i] holds the earlier cells that can't repeat cell i's number,
+    those fills are dropped here too.
+    Sums and products too big or not dividing result are cut off early
+    so big blocks don't try all maxValue**n fills.
+    Cached so models with the same blocks share one tuple of tuples"""
+    n = len(clashes)
+    tuples = []
+    vals = [0] * n
+    def fill(i, total, prod):
+        if i == n:
+            if blockMath(op, result, vals):
+                tuples.append(tuple(vals))
+            return
+        left = n - i - 1 # Cells after this one
+        for v in range(1, maxValue+1):
+            if any(vals[j] == v for j in clashes[i]):
+                continue
+            if op == '+' and not (total + v + left <= result <= total + v + left*maxValue):
+                continue
+            if op in ['*', 'x', '×'] and result % (prod * v) != 0:
+                continue
+            vals[i] = v
+            fill(i+1, total + v, prod * v)
+    fill(0, 0, 1)
+    return tuple(tuples)
+
+
+class AllDifferent:
+    """No number twice in cells"""
+    __slots__ = ('cells',)
+
+    def __init__(self, cells):
+        self.cells = tuple(cells)
+
+    def propagate(self, model, index):
+        """Clear filled numbers from the other cells, and when there are
+        just enough numbers to go around, set numbers with only 1 spot left
+
+        Returns changed cells"""
+        changed = []
+        numbers = model.numbers
+        possible = model.possible
+        again = True
+        while again:
+            again = False
+            taken = 0
+            for i in self.cells:
+                if numbers[i]:
+                    bit = 1 << numbers[i]
+                    if taken & bit:
+                        raise Contradiction
+                    taken |= bit
+            for i in self.cells:
+                if not numbers[i] and possible[i] & taken and model.narrow(i, ~taken):
+                    changed.append(i)
+                    again = again or numbers[i] != 0
+            once = 0
+            twice = 0
+            for i in self.cells:
+                twice |= once & possible[i]
+                once |= possible[i]
+            spare = bin(once).count('1') - len(self.cells)
+            if spare < 0:
+                raise Contradiction # Not enough numbers to go around
+            if spare == 0:
+                for num in numbersIn(once & ~twice):
+                    for i in self.cells:
+                        if possible[i] >> num & 1:
+                            if not numbers[i] and model.narrow(i, 1 << num):
+                                changed.append(i)
+                                again = True
+                            break
+        return changed
+
+    def conflicts(self, model, cell, num):
+        """The filled cell already holding num, None if num fits"""
+        for i in self.cells:
+            if i != cell and model.numbers[i] == num:
+                return {i}
+        return None
+
+    def isSolved(self, numbers):
+        vals = [numbers[i] for i in self.cells]
+        return 0 not in vals and len(set(vals)) == len(vals)
+
+class Cage:
+    """Cells that have to do op to make result
+
+    tuples - every fill of cells that does the math, shared between models
+    clashes[i] - earlier cells that can't repeat cell i's number,
+                 every earlier cell if not given, like killer sudoku cages"""
+    __slots__ = ('op', 'result', 'cells', 'tuples')
+
+    def __init__(self, op, result, cells, maxValue, clashes = None):
+        self.cells = tuple(cells)
+        self.result = result
+        self.op = op
+        if clashes is None:
+            clashes = tuple(tuple(range(i)) for i in range(len(self.cells)))
+        self.tuples = findTuples(op, result, maxValue, clashes)
+
+    def propagate(self, model, index):
+        """Drop tuples that don't fit the possible masks anymore,
+        then drop possible numbers no tuple uses
+
+        Returns changed cells"""
+        possible = model.possible
+        fits = [t for t in model.fits[index]
+                if all(possible[i] >> n & 1 for n, i in zip(t, self.cells))]
+        if not fits:
+            raise Contradiction
+        model.fits[index] = fits
+        changed = []
+        for k, i in enumerate(self.cells):
+            used = 0
+            for t in fits:
+                used |= 1 << t[k]
+            if model.narrow(i, used):
+                changed.append(i)
+        return changed
+
+    def conflicts(self, model, cell, num):
+        """The cage's other filled cells if num can't do the math with them, else None"""
+        numbers = model.numbers
+        for t in self.tuples:
+            if all(n == num if i == cell else numbers[i] in (0, n) for n, i in zip(t, self.cells)):
+                return None
+        return set(i for i in self.cells if i != cell and numbers[i])
+
+    def isSolved(self, numbers):
+        return self.check([numbers[i] for i in self.cells])
+
+    def check(self, vals):
+        return blockMath(self.op, self.result, vals)
+
+
+class ExactCover:
+    """Knuth's dancing links, pick rows so every column is covered exactly once
+
+    Nodes are flat lists of links, L R U D, C for a node's column header and rowOf for its row.
+    Headers are nodes 0 to columns-1 and root is node columns.
+    S counts nodes left in each column, the search branches on the smallest.
+    nodes counts rows tried"""
+    __slots__ = ('L', 'R', 'U', 'D', 'C', 'S', 'rowOf', 'root', 'nodes')
+
+    def __init__(self, columns, rows):
+        """rows is a list of column index lists, a column at most once per row"""
+        root = columns
+        self.root = root
+        self.L = list(range(-1, columns))
+        self.L[0] = root
+        self.R = list(range(1, columns+1)) + [0 if columns else root]
+        self.U = list(range(columns+1))
+        self.D = list(range(columns+1))
+        self.C = list(range(columns+1))
+        self.rowOf = [-1] * (columns+1)
+        self.S = [0] * columns
+        self.nodes = 0
+        L, R, U, D, C = self.L, self.R, self.U, self.D, self.C
+        for r, cols in enumerate(rows):
+            first = None
+            for c in cols:
+                x = len(C)
+                C.append(c)
+                self.rowOf.append(r)
+                U.append(U[c])
+                D.append(c)
+                D[U[c]] = x
+                U[c] = x
+                self.S[c] += 1
+                if first is None:
+                    first = x
+                    L.append(x)
+                    R.append(x)
+                else:
+                    L.append(L[first])
+                    R.append(first)
+                    R[L[first]] = x
+                    L[first] = x
+
+    def cover(self, c):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        R[L[c]] = R[c]
+        L[R[c]] = L[c]
+        i = D[c]
+        while i != c:
+            j = R[i]
+            while j != i:
+                U[D[j]] = U[j]
+                D[U[j]] = D[j]
+                S[C[j]] -= 1
+                j = R[j]
+            i = D[i]
+
+    def uncover(self, c):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        i = U[c]
+        while i != c:
+            j = L[i]
+            while j != i:
+                S[C[j]] += 1
+                U[D[j]] = j
+                D[U[j]] = j
+                j = L[j]
+            i = U[i]
+        R[L[c]] = c
+        L[R[c]] = c
+
+    def solutions(self, chosen = None):
+        """Yield every exact cover as a list of row indices
+
+        Stopping early leaves columns covered, make a new ExactCover to search again"""
+        chosen = [] if chosen is None else chosen
+        R, D, C, S = self.R, self.D, self.C, self.S
+        if R[self.root] == self.root:
+            yield list(chosen)
+            return
+        c = R[self.root]
+        j = R[c]
+        while j != self.root: # Column with the fewest rows left
+            if S[j] < S[c]:
+                c = j
+            j = R[j]
+        if S[c] == 0:
+            return
+        self.cover(c)
+        r = D[c]
+        while r != c:
+            self.nodes += 1
+            chosen.append(self.rowOf[r])
+            j = R[r]
+            while j != r:
+                self.cover(C[j])
+                j = R[j]
+            yield from self.solutions(chosen)
+            j = self.L[r]
+            while j != r:
+                self.uncover(C[j])
+                j = self.L[j]
+            chosen.pop()
+            r = D[r]
+        self.uncover(c)
+
+    def solve(self):
+        """First exact cover's row indices, None if there is none"""
+        return next(self.solutions(), None)
+
+
+class Model:
+    """Cells, their possible numbers and the rules between them
+
+    Flat arrays indexed by cell
+    numbers - bytearray of set numbers, 0 is empty
+    possible - array of bitmasks, see numbersIn
+    constraints - AllDifferent and Cage rules
+    fits - cage tuples that still fit the possible masks, trimmed by propagate
+    watchers - rule indices for each cell, made when first needed
+    order - backtrack's way to pick the next cell, one of orders
+    values - order to try numbers in a cell, one of valueOrders
+    nogoods - numbers backjump learned can't go together, watch finds them by (cell, number)
+    guesses, nodes, checks - counts of playerSolver guesses, numbers placed by backtrack
+                             and backjump, and rule checks made, for benchmarks
+    """
+    __slots__ = ('maxValue', 'numbers', 'possible', 'constraints', 'fits', 'watchers',
+                 'guesses', 'nodes', 'checks', 'order', 'values', 'verbose', 'nogoods', 'watch')
+    orders = ('index', 'mrv', 'degree', 'cage')
+    valueOrders = ('up', 'down', 'tuples')
+    engines = ('playerSolver', 'backtrack', 'backjump')
+    maxNogoods = 1000 # Learned by backjump, oldest dropped first
+    nogoodSize = 8 # Most cells in a learned nogood, 4 threw most blame sets away
+
+    def __init__(self, cells = 0, maxValue = 9):
+        self.maxValue = maxValue
+        self.numbers = bytearray([1 if maxValue == 1 else 0]) * cells # 1 number is already set
+        self.possible = array('H' if maxValue < 16 else 'L', [(1 << (maxValue+1)) - 2]) * cells
+        self.constraints = []
+        self.fits = []
+        self.watchers = None
+        self.guesses = 0
+        self.nodes = 0
+        self.checks = 0
+        self.order = 'cage'
+        self.values = 'up'
+        self.verbose = False
+        self.nogoods = None # Made by backjump
+        self.watch = None
+
+    def add(self, constraint):
+        """Add a rule, returns it"""
+        self.constraints.append(constraint)
+        self.fits.append(getattr(constraint, 'tuples', None))
+        self.watchers = None
+        return constraint
+
+    def getWatchers(self):
+        if self.watchers is None:
+            watchers = [[] for _ in self.numbers]
+            for ci, c in enumerate(self.constraints):
+                for i in c.cells:
+                    watchers[i].append(ci)
+            self.watchers = [tuple(w) for w in watchers]
+        return self.watchers
+
+    def setNumber(self, cell, num):
+        self.numbers[cell] = num
+        self.possible[cell] = 1 << num
+
+    def narrow(self, cell, mask):
+        """Keep only the possible numbers in mask, sets the number once 1 is left
+
+        Returns True if anything changed"""
+        old = self.possible[cell]
+        new = old & mask
+        if new == old:
+            return False
+        if not new:
+            raise Contradiction
+        self.possible[cell] = new
+        if not new & (new - 1):
+            self.numbers[cell] = new.bit_length() - 1
+        return True
+
+    def propagate(self):
+        """Run the rules until nothing changes
+
+        Every rule starts on the queue, a rule goes back on when one of its cells changes.
+        Raises Contradiction when the puzzle can't be solved from here"""
+        watchers = self.getWatchers()
+        queue = deque(range(len(self.constraints)))
+        queued = bytearray(b'\x01') * len(self.constraints)
+        while queue:
+            ci = queue.popleft()
+            queued[ci] = 0
+            self.checks += 1
+            for i in self.constraints[ci].propagate(self, ci):
+                for cj in watchers[i]:
+                    if not queued[cj] and cj != ci:
+                        queued[cj] = 1
+                        queue.append(cj)
+
+    def saveState(self):
+        return bytes(self.numbers), self.possible[:], self.fits[:]
+
+    def restoreState(self, state):
+        numbers, possible, fits = state
+        self.numbers[:] = numbers
+        self.possible[:] = possible
+        self.fits = fits[:]
+
+    def isSolved(self):
+        """Every cell filled and every rule happy"""
+        return 0 not in self.numbers and all(c.isSolved(self.numbers) for c in self.constraints)
+
+    def solution(self):
+        """Numbers cell by cell as one string"""
+        return ''.join(str(n) for n in self.numbers)
+
+    def conflicts(self, cell, num):
+        """Filled cells that stop num going in cell, None if it fits
+
+        An empty set means num never fits there"""
+        if not self.possible[cell] >> num & 1:
+            return set()
+        for ci in self.getWatchers()[cell]:
+            self.checks += 1
+            culprits = self.constraints[ci].conflicts(self, cell, num)
+            if culprits is not None:
+                return culprits
+        return None
+
+    def candidates(self, cell):
+        """Numbers that fit every rule on cell right now"""
+        return [n for n in numbersIn(self.possible[cell]) if self.conflicts(cell, n) is None]
+
+    def degree(self, cell):
+        """Count empty cells sharing a rule with cell"""
+        peers = set()
+        for ci in self.getWatchers()[cell]:
+            peers.update(self.constraints[ci].cells)
+        peers.discard(cell)
+        return sum(1 for i in peers if self.numbers[i] == 0)
+
+    def cageOptions(self, index):
+        """Count a cage's tuples that still fit the board"""
+        numbers = self.numbers
+        watchers = self.getWatchers()
+        cage = self.constraints[index]
+        allowed = [] # Mask of numbers each cell could take from its other rules
+        for i in cage.cells:
+            if numbers[i]:
+                allowed.append(1 << numbers[i])
+                continue
+            mask = 0
+            self.checks += len(watchers[i])
+            for n in numbersIn(self.possible[i]):
+                if all(ci == index or self.constraints[ci].conflicts(self, i, n) is None
+                       for ci in watchers[i]):
+                    mask |= 1 << n
+            allowed.append(mask)
+        return sum(1 for t in cage.tuples if all(m >> n & 1 for n, m in zip(t, allowed)))
+
+    def nextCell(self, cellIndex, order):
+        """Pick the next empty cell to fill and its valid numbers
+
+        order is one of Model.orders
+          index  - next empty cell after cellIndex
+          mrv    - cell with the fewest valid numbers
+          degree - mrv, ties go to the cell with the most empty neighbours
+          cage   - cage with the fewest tuples left, then degree inside it,
+                   just degree without cages
+        Returns (None, []) once every cell is filled"""
+        numbers = self.numbers
+        if order == 'index':
+            while cellIndex < len(numbers) and numbers[cellIndex] != 0:
+                cellIndex += 1
+            if cellIndex == len(numbers):
+                return None, []
+            return cellIndex, self.candidates(cellIndex)
+        empty = [i for i, n in enumerate(numbers) if n == 0]
+        if not empty:
+            return None, []
+        if order == 'cage':
+            unfilled = [ci for ci, c in enumerate(self.constraints) if isinstance(c, Cage)
+                        and 0 in [numbers[i] for i in c.cells]]
+            if unfilled:
+                ci = min(unfilled, key=self.cageOptions)
+                empty = [i for i in self.constraints[ci].cells if numbers[i] == 0]
+        best = None
+        for i in empty:
+            options = self.candidates(i)
+            if not options:
+                return i, options # Dead end, fail fast
+            key = len(options) if order == 'mrv' else (len(options), -self.degree(i))
+            if best is None or key < best[0]:
+                best = (key, i, options)
+        return best[1], best[2]
+
+    def orderValues(self, cell, options):
+        """Numbers to try in a cell, in self.values order
+
+          up     - smallest first
+          down   - biggest first
+          tuples - the number most of the cell's cage tuples use first, up without a cage
+        """
+        if self.values == 'down':
+            return sorted(options, reverse=True)
+        if self.values == 'tuples':
+            numbers = self.numbers
+            for ci in self.getWatchers()[cell]:
+                cells = self.constraints[ci].cells
+                if self.fits[ci] is None:
+                    continue
+                k = cells.index(cell)
+                uses = [0] * (self.maxValue+1)
+                for t in self.fits[ci]:
+                    if all(numbers[i] == n or numbers[i] == 0 for n, i in zip(t, cells)):
+                        uses[t[k]] += 1
+                return sorted(options, key=lambda n: -uses[n])
+        return sorted(options)
+
+    def backtrack(self, num = 1, cellIndex = 0, order = None):
+        """Fill empty cells one at a time, step back when a cell has no valid number
+
+        order picks the next cell, see nextCell, defaults to self.order
+        Counts numbers placed in self.nodes
+        Returns True if solved"""
+        order = order or self.order
+        cellIndex, options = self.nextCell(cellIndex, order)
+        if cellIndex is None:
+            return True # Every cell filled
+        for n in self.orderValues(cellIndex, options):
+            if n < num:
+                continue
+            self.nodes += 1
+            self.numbers[cellIndex] = n
+            if self.verbose:
+                print(n, 'at', cellIndex)
+                print(self)
+            if self.backtrack(1, cellIndex + 1, order):
+                return True
+        self.numbers[cellIndex] = 0 # Backtrack
+        return False
+
+    def brokenNogood(self, cell, num):
+        """Rest of a learned nogood num in cell would complete, else None"""
+        for nogood in self.watch.get((cell, num), ()):
+            if all(self.numbers[i] == n for i, n in nogood if i != cell):
+                return set(i for i, n in nogood if i != cell)
+        return None
+
+    def learn(self, cells):
+        """Remember the numbers in cells as a nogood, they can't all be right together
+
+        Only small nogoods are kept and only the last maxNogoods of them"""
+        if not cells or len(cells) > self.nogoodSize:
+            return
+        nogood = frozenset((i, self.numbers[i]) for i in cells)
+        if nogood in self.nogoods:
+            self.nogoods.move_to_end(nogood)
+            return
+        self.nogoods[nogood] = None
+        for literal in nogood:
+            self.watch.setdefault(literal, []).append(nogood)
+        if len(self.nogoods) > self.maxNogoods:
+            old, _ = self.nogoods.popitem(last=False)
+            for literal in old:
+                self.watch[literal].remove(old)
+
+    def backjump(self, order = None):
+        """backtrack, but jump straight back to a cell to blame at a dead end
+
+        Each cell keeps the set of filled cells that ruled its numbers out.
+        When it runs out of numbers, cells after the last one to blame are skipped,
+        and the blamed numbers are learned as a nogood so they aren't tried together again.
+        Counts numbers placed in self.nodes
+        Returns True if solved"""
+        if self.nogoods is None:
+            self.nogoods = OrderedDict()
+            self.watch = {}
+        return self.conflictSearch(order or self.order) is None
+
+    def conflictSearch(self, order):
+        """backjump's search, returns None once solved or the cells to blame for failing"""
+        cellIndex, options = self.nextCell(0, order)
+        if cellIndex is None:
+            return None # Every cell filled
+        blame = set()
+        for num in self.orderValues(cellIndex, range(1, self.maxValue+1)):
+            if num in options:
+                culprits = self.brokenNogood(cellIndex, num)
+            else:
+                culprits = self.conflicts(cellIndex, num)
+            if culprits is not None:
+                blame |= culprits
+                continue
+            self.nodes += 1
+            self.numbers[cellIndex] = num
+            if self.verbose:
+                print(num, 'at', cellIndex)
+                print(self)
+            culprits = self.conflictSearch(order)
+            if culprits is None:
+                return None
+            self.numbers[cellIndex] = 0
+            if cellIndex not in culprits:
+                return culprits # Not this cell's fault, jump past it
+            culprits.discard(cellIndex)
+            blame |= culprits
+        self.learn(blame)
+        return blame
+
+    def playerSolver(self):
+        """Try to solve like a player would.
+
+        Rule out numbers with every rule until stuck,
+        then guess on the cell with the fewest options and backtrack.
+        Returns True if solved"""
+        try:
+            self.propagate()
+        except Contradiction:
+            return False
+        empty = [i for i, n in enumerate(self.numbers) if n == 0]
+        if not empty:
+            return True
+        cell = min(empty, key=lambda i: len(numbersIn(self.possible[i])))
+        state = self.saveState()
+        for num in self.orderValues(cell, numbersIn(self.possible[cell])):
+            self.guesses += 1
+            self.setNumber(cell, num)
+            if self.playerSolver():
+                return True
+            self.restoreState(state)
+        return False
+
+    def countSolutions(self, limit = 2):
+        """Count solutions like playerSolver, but keep guessing after the first
+
+        Stops once limit are found, 2 is enough to tell a puzzle isn't unique.
+        Leaves the model how it was after propagating"""
+        try:
+            self.propagate()
+        except Contradiction:
+            return 0
+        empty = [i for i, n in enumerate(self.numbers) if n == 0]
+        if not empty:
+            return 1
+        cell = min(empty, key=lambda i: len(numbersIn(self.possible[i])))
+        state = self.saveState()
+        count = 0
+        for num in numbersIn(self.possible[cell]):
+            self.guesses += 1
+            self.setNumber(cell, num)
+            count += self.countSolutions(limit - count)
+            self.restoreState(state)
+            if count >= limit:
+                break
+        return count
+
+    def solve(self, engine = 'playerSolver'):
+        """Solve with a search engine
+
+        engine is a name from engines, or any function taking the model
+        that fills in numbers and returns True if solved"""
+        if callable(engine):
+            return engine(self)
+        if engine not in self.engines:
+            raise ValueError("Unknown engine {}".format(engine))
+        return getattr(self, engine)()
@@ -3,6 +3,7 @@ Kenken Solver
     Copied from sudoku solver
     How do we feed in the board?
     Size and list of blocks with op result r,c r,c r,c ...
+    Rules and search live in constraintSolver, shared with sudoku
 
 How many ways to solve?
 1. Brute Force (Iterative?)
@@ -16,84 +17,73 @@ How many ways to solve?
     Train a neural network to play?
     How would we input blocks and their math rules?
 """
-    #TODO Clean out unused SudokuSolver junk
-    #TODO Speed backtracking by ruling out numbers, e.g. If 10x, rule out 3, 4, and 6
-    #Only need 1 pass to generate exclusions for blocks and pass that to the cells for lookup while backtracking
 
+import os
+import sys
+import json
+import cProfile
+import platform
+import subprocess
 from math import isqrt
+from array import array
 from time import perf_counter
-from functools import reduce
-
-
-"""OOP Monster"""
-class Cell:
-    def __init__(self, row = 0, col = 0, number = 0, maxVal = 6):
-        self.number = number
-        self.possible = [x for x in range(1, maxVal) if self.number == 0]
-        self.block = None # Reference to block
-        self.row = row
-        self.col = col
-
-class Block:
-    def __init__(self, op = '', result = 0, cells = []):
-        self.cells = cells # List not used outside
-        self.result = result
-        self.op = op
-
-    def isValid(self):
-        vals = [x.number for x in self.cells]
-        print(vals)
-        if 0 in vals:
-            print('Has 0')
-            return True
-        else:
-            return self.isSolved()
-
-    def isSolved(self):
-        vals = [x.number for x in self.cells]
-        if self.op == '+':
-            return sum(vals) == self.result
-        elif self.op in ['*', 'x', '×']:
-            prod = reduce(lambda x,y: x*y, vals)
-            return prod == self.result
-        # Max value first for - or ÷
-        vals.sort(reverse=True)
-        if self.op in ['/', '÷']:
-            r = reduce(lambda x,y: x/y, vals)
-            print('division', vals, r)
-            return self.result == reduce(lambda x,y: x/y, vals)
-        elif self.op == '-':
-            r = reduce(lambda x,y: x-y, vals)
-            print('subtraction', vals, r)
-            return self.result == reduce(lambda x,y: x-y, vals)
-        else:
-            raise RuntimeError("Missing operation for a KenKen block")
+from functools import reduce, lru_cache
+from itertools import islice
+from random import Random
+from multiprocessing import Pool, Process, Queue
+
+from constraintSolver import Model, AllDifferent, Cage, ExactCover, numbersIn
+
 
-class Board:
+@lru_cache(maxsize=None)
+def getUnits(size):
+    """AllDifferent rules for every row then every column, shared by boards of a size"""
+    rows = [AllDifferent(range(r*size, (r+1)*size)) for r in range(size)]
+    cols = [AllDifferent(range(c, size*size, size)) for c in range(size)]
+    return tuple(rows + cols)
+
+
+class Board(Model):
     """Kenken Board
-    
-    Just holds data and tests
 
-    cells - list of Cells
-    blocks - list of Blocks
+    A Model with flat arrays indexed by row * size + col,
+    rows and columns are AllDifferent and blocks are Cages
+
+    blockOf - bytearray of block index for each cell
+    blocks - list of Cages, also in constraints after the rows and columns
     """
+    __slots__ = ('size', 'blockOf', 'blocks')
+    engines = Model.engines + ('dlx',)
     def __init__(self, size = 0, blocks = []):
         """
         size is number of rows or columns
         blocks is a long list
           op, result, [cell indices], op, result, [cell indices], ...
         """
+        if not 1 <= size <= 9:
+            raise ValueError("Board size {} isn't 1 to 9".format(size))
+        super().__init__(size**2, size)
         self.size = size
-        self.cells = [Cell(row = x//size, col = x%size, maxVal=size) for x in range(size**2)]
+        self.blockOf = bytearray(size**2)
         self.blocks = []
+        for unit in getUnits(size):
+            self.add(unit)
+        seen = set()
         for i in range(0, len(blocks), 3):
-            op = blocks[i]
-            result = blocks[i+1]
-            cells = [self.cells[j] for j in blocks[i+2]]
-            self.blocks.append(Block(op, result, cells))
-            b = self.blocks[-1]
-            for c in b.cells:
-                c.block = b
+            cells = blocks[i+2]
+            for j in cells:
+                if j in seen or not 0 <= j < size**2:
+                    raise ValueError("Cell {} is off the board or in 2 blocks".format(j))
+                seen.add(j)
+                self.blockOf[j] = len(self.blocks)
+            # Block cells sharing a row or column can't repeat a number
+            clashes = tuple(tuple(j for j in range(k)
+                                  if cells[k] // size == cells[j] // size
+                                  or cells[k] % size == cells[j] % size)
+                            for k in range(len(cells)))
+            self.blocks.append(self.add(Cage(blocks[i], blocks[i+1], cells, size, clashes)))
+        if blocks and len(seen) != size**2:
+            raise ValueError("Cells {} aren't in a block".format(sorted(set(range(size**2)) - seen)))
 
     def __str__(self):
         """Print pretty square
@@ -114,16 +104,16 @@ class Board:
         row1 = "|"
         row2 = "|"
         row3 = "|"
-        for i, c in enumerate(self.cells):
+        for i, n in enumerate(self.numbers):
             col = i % self.size
             row = i // self.size
             row0 += '   '
-            row1 += ' {} '.format(c.number)
+            row1 += ' {} '.format(n)
             row2 += '   '
             down = None
             if row < self.size-1:
-                down = self.cells[i+self.size]
-                if c.block == down.block:
+                down = i + self.size
+                if self.blockOf[i] == self.blockOf[down]:
                     row3 += '   '
                 else:
                     row3 += '---'
@@ -141,8 +131,7 @@ class Board:
                 row2 = "|"
                 row3 = "|"
             else:
-                right = self.cells[i+1]
-                if right.block == c.block:
+                if self.blockOf[i+1] == self.blockOf[i]:
                     row0 += ' '
                     row1 += ' '
                     row2 += ' '
@@ -155,311 +144,583 @@ class Board:
         s += '\'' + '-' * (width - 2) + '\'\n'
         return s
 
+    def toBlocks(self):
+        """Blocks back as the long list __init__ takes"""
+        blocks = []
+        for b in self.blocks:
+            blocks += [b.op, b.result, list(b.cells)]
+        return blocks
+
     def getRow(self, index):
         start = index*self.size
         end = start + self.size
-        return [self.cells[i].number for i in range(start, end)]
+        return list(self.numbers[start:end])
 
     def getRowPossible(self, index):
         start = index*self.size
         end = start + self.size
-        return [self.cells[i].possible for i in range(start, end)]
+        return [list(numbersIn(m)) for m in self.possible[start:end]]
 
     def getColumn(self, index):
-        start = index
-        end = self.size**2
-        return [self.cells[i].number for i in range(start, end, self.size)]
+        return list(self.numbers[index::self.size])
 
     def getColumnPossible(self, index):
-        start = index
-        end = self.size**2
-        return [self.cells[i].possible for i in range(start, end, self.size)]
+        return [list(numbersIn(m)) for m in self.possible[index::self.size]]
 
     def getBlock(self, cellIndex):
-        b = self.cells[cellIndex].block
-        return [c.number for c in b.cells]
-
-    def validNumberInRow(self, number, index):
-        r = index//self.size
-        return number not in self.getRow(r)
-    
-    def validNumberInColumn(self, number, index):
-        c = index % self.size
-        return number not in self.getColumn(c)
-
-    def validNumberInBlock(self, number, cellIndex):
-        cell = self.cells[cellIndex]
-        # Probably overkill keeping number or not...
-        original = cell.number
-        cell.number = number
-        good = cell.block.isValid()
-        if good:
-            return True
-        else:
-            cell.number = original
-            return False
-
-    def isValidNumber(self, num, index):
-        return self.validNumberInRow(num, index) \
-            and self.validNumberInColumn(num, index) \
-            and self.validNumberInBlock(num, index)
-
-    def backtrack(self, num, cellIndex):
-        N = self.size
-        r = cellIndex//N
-        if r == N: # Done
-            return True
-        # Find next empty cell
-        while self.cells[cellIndex].number != 0:
-            cellIndex += 1
-            r = cellIndex//N
-            if r == N:
-                return True # Every cell filled
-        c = cellIndex % N
-        for num in range(num, N+1):
-            if not self.isValidNumber(num, cellIndex):
-                continue
-            print(num, 'at {}, {}'.format(r,c))
-            self.cells[cellIndex].number = num
-            print(self)
-            if not self.backtrack(1, cellIndex + 1):
-                continue
-            else:
-                return True
-        self.cells[cellIndex].number = 0 # Backtrack
-        return False
+        b = self.blocks[self.blockOf[cellIndex]]
+        return [self.numbers[i] for i in b.cells]
 
     def printPossible(self):
         """Print possible numbers
 
-        9x9 grid of 3x3 grid single space gap
-
-        123 12   2  | 123 123 123
-        456 4 6  56
-        789   9 789
+        Each cell is a small grid of its possible numbers,
+        3x3 for 5x5 boards and up, 2x2 below that.
+        | and - mark block walls like the board print
 
-        123
+        123 12  |  2
+        456 4 6 | 56
+        789   9 |789
 
         Loops
-          main rows 9x9 sudoku cells
+          board rows
           minor rows for possible 123, 456, 789 rows
-          sudoku columns
+          board columns
           numbers in minor col based on minor row
         """
+        N = self.size
+        k = isqrt(N-1) + 1
         s = ""
-        sep1 = (' '*12 + '| ')*2 + ' '*11 + '\n'
-        sep2 = sep1.replace(' ', '-').replace('|', '+')
-        for i, row in enumerate(self.possible):
-            if (i != 0) and (i%3 == 0):
-                s += sep2
-            for j in range(3): # 1 4 7
-                for k, n in enumerate(row):
-                    if (k != 0) and (k%3 == 0):
-                        s += '| '
-                    x = [x for x in range((j*3)+1, (j*3)+4)]
-                    for l in x:
-                        if l in n:
-                            s += str(l)
+        for row in range(N):
+            for j in range(k):
+                for col in range(N):
+                    i = row*N + col
+                    for n in range(j*k+1, j*k+k+1):
+                        if n <= N and self.possible[i] >> n & 1:
+                            s += str(n)
                         else:
                             s += ' '
-                    s += ' '
-                s += '|\n'
-            s += sep1
+                    if col < N-1:
+                        s += '|' if self.blockOf[i] != self.blockOf[i+1] else ' '
+                s += '\n'
+            if row < N-1:
+                for col in range(N):
+                    i = row*N + col
+                    s += ('-' if self.blockOf[i] != self.blockOf[i+N] else ' ') * k + ' '
+                s += '\n'
         print(s)
 
-    def printPossibleBlock(self, x, y, sudokuGrid = 9):
-        """
+    def exactCover(self):
+        """Board as exact cover, returns (ExactCover, (block, tuple) per row)
 
-        Indices
-        1 2 3 \n
-        4 5 6 \n
-        7 8 9
+        A row per block tuple that fits the possible masks, covering
+        a column per cell, per row and number, and per column and number"""
+        N = self.size
+        rows = []
+        placements = []
+        for b in self.blocks:
+            for t in b.tuples:
+                if all(self.possible[i] >> n & 1 for n, i in zip(t, b.cells)):
+                    rows.append([col for n, i in zip(t, b.cells)
+                                 for col in (i, N*N + i // N * N + n-1, 2*N*N + i % N * N + n-1)])
+                    placements.append((b, t))
+        return ExactCover(3*N*N, rows), placements
+
+    def dlx(self):
+        """Solve as exact cover with dancing links
+
+        Picks one tuple per block so every cell, row number and column number is used once.
+        Counts rows tried in self.nodes
+        Returns True if solved"""
+        cover, placements = self.exactCover()
+        rows = cover.solve()
+        self.nodes += cover.nodes
+        if rows is None:
+            return False
+        for r in rows:
+            b, t = placements[r]
+            for n, i in zip(t, b.cells):
+                self.setNumber(i, n)
+        return True
+
+    def toText(self):
+        """Puzzle in the readPuzzles text format"""
+        s = "{}\n".format(self.size)
+        for b in self.blocks:
+            s += "{} {} {}\n".format(b.op or '=', b.result, ' '.join(str(i) for i in b.cells))
+        return s
 
-        For each index row
-        123 123 123 \n
-        """
-        indices = self.getBlockIndices(x, y)
-        #print(indices, len(indices))
-        # Indices are row by row
-        blockSize = isqrt(sudokuGrid)
-        #print("size", blockSize)
-        s = ""
-        for row in range(blockSize): # 0, 3, 6
-            rIndex = row * blockSize
-            for j in range(blockSize): # minirow/col
-                for col in range(blockSize): # 1 2 3 /n
-                    index = rIndex + col
-                    #print("Index", index)
-                    #print("\t", indices[index])
-                    r,c = indices[index]
-                    p = self.possible[r][c]
-                    x = [x for x in range((j*3)+1, (j*3)+4)]
-                    for l in x:
-                        if l in p:
-                            s += str(l)
-                        else:
-                            s += ' '
-                    s += ' '
-                s += '\n'
-            s += '\n'
-        print(s)
 
+def latinSquare(size, rng):
+    """Random latin square as a flat list, row by row
 
-    def updatePossible(self):
-        """Remove set on board numbers from possible lists
+    Fills cells in order with shuffled numbers, backtracking on dead ends"""
+    numbers = [0] * size**2
+    def fill(i):
+        if i == size**2:
+            return True
+        r, c = i // size, i % size
+        used = set(numbers[r*size:i]) | set(numbers[c:i:size])
+        options = [n for n in range(1, size+1) if n not in used]
+        rng.shuffle(options)
+        for n in options:
+            numbers[i] = n
+            if fill(i+1):
+                return True
+        numbers[i] = 0
+        return False
+    fill(0)
+    return numbers
+
+def randomBlocks(size, rng, sizes = (1, 2, 2, 2, 3, 3, 3, 4)):
+    """Split the board into random blocks of connected cells
+
+    Block sizes are picked from sizes, a block stops early if it's boxed in"""
+    free = set(range(size**2))
+    cells = list(free)
+    rng.shuffle(cells)
+    blocks = []
+    for start in cells:
+        if start not in free:
+            continue
+        free.discard(start)
+        block = [start]
+        want = rng.choice(sizes)
+        while len(block) < want:
+            edges = []
+            for i in block:
+                r, c = i // size, i % size
+                if r > 0: edges.append(i - size)
+                if r < size-1: edges.append(i + size)
+                if c > 0: edges.append(i - 1)
+                if c < size-1: edges.append(i + 1)
+            edges = [i for i in edges if i in free]
+            if not edges:
+                break
+            i = rng.choice(edges)
+            free.discard(i)
+            block.append(i)
+        blocks.append(sorted(block))
+    return blocks
+
+def blockOp(vals, rng):
+    """Pick an op for a block's solution numbers, returns (op, result)
+
+    Pairs prefer ÷ or -, they pin numbers down more than + or *"""
+    if len(vals) == 1:
+        return '=', vals[0]
+    big, small = max(vals), min(vals)
+    if len(vals) == 2 and big % small == 0 and rng.random() < 0.5:
+        return '/', big // small
+    if len(vals) == 2 and rng.random() < 0.6:
+        return '-', big - small
+    if rng.random() < 0.5:
+        return '+', sum(vals)
+    return '*', reduce(lambda x,y: x*y, vals)
+
+def generate(size, seed):
+    """Make a unique solution puzzle, the same one every time for a seed
+
+    Latin square, random blocks, ops from the square's numbers,
+    then retry until countSolutions stops at 1"""
+    rng = Random(seed)
+    while True:
+        numbers = latinSquare(size, rng)
+        blocks = []
+        for cells in randomBlocks(size, rng):
+            op, result = blockOp([numbers[i] for i in cells], rng)
+            blocks += [op, result, cells]
+        board = Board(size, blocks)
+        if board.countSolutions() == 1:
+            return Board(size, blocks)
+
+def generateBoard(job):
+    """Pool worker for generateFile, job is (size, seed)"""
+    return generate(*job).toText()
+
+def generateFile(size, count, seed = 0, out = sys.stdout, jobs = 1):
+    """Write count unique puzzles in the readPuzzles text format
+
+    Puzzle i gets its own seed from seed, size and i,
+    so the file comes out the same with any number of jobs"""
+    seeds = [(size, "{} {} {}".format(seed, size, i)) for i in range(count)]
+    p0 = perf_counter()
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            for text in pool.imap(generateBoard, seeds):
+                out.write(text + "\n")
+    else:
+        for text in map(generateBoard, seeds):
+            out.write(text + "\n")
+    pT = perf_counter() - p0
+    out.write("# {} {}x{} puzzles, seed {}\n".format(count, size, size, seed))
+    print("{} {}x{} puzzles in {:.3f}s".format(count, size, size, pT), file=sys.stderr) # Keeps the file the same every run
 
-        Returns number of changed cells"""
-        changes = 0
-        for i in range(81):
-            r = i // 9
-            c = i % 9
-            n = self.numbers[r][c]
-            if n == 0:
-                continue
-            # Clear row
-            for j in self.possible[r]:
-                if len(j) == 1:
-                    continue
-                if n in j:
-                    j.remove(n)
-                    changes += 1
-            # Clear column
-            for row in self.possible:
-                if len(row[c]) == 1:
-                    continue
-                if n in row[c]:
-                    row[c].remove(n)
-                    changes += 1
-                    row0 += ' '
-                    row1 += ' '
-                    row2 += ' '
-                    row3 += '.'
-            # Clear block
-            r0 = r - r%3
-            c0 = c - c%3
-            for row in range(r0, r0+3):
-                for col in range(c0, c0+3):
-                    cell = self.possible[row][col]
-                    if len(cell) > 1 and n in cell:
-                        cell.remove(n)
-                        changes += 1
-        return changes
-
-    def trySetBoard(self):
-        """Look for possible numbers lists with only 1 option
-
-        Return number of changes"""
-        changes = 0
-        for r in range(9):
-            for c in range(9):
-                p = self.possible[r][c]
-                n = self.numbers[r][c]
-                if not p and n == 0:
-                    raise RuntimeError("The programmer is an idiot, let him know he messed up.")
-                elif len(p) == 1 and n == 0:
-                    self.numbers[r][c] = p.pop()
-                    changes += 1
-                elif len(p) == 1 and n != 0:
-                    if n == p[0]:
-                        p.pop()
-                    else:
-                        print("Problem at {} {}".format(r, c))
-                else:
-                    pass # many possible, hopefully n is 0...
-        return changes
 
-    def removeFromRow(self, num, rowIndex, exclude = []):
-        changes = 0
-        for i,c in enumerate(self.possible[rowIndex]):
-            if i in exclude:
+benchFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kenkenBench.txt')
+sizesFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kenkenSizes.txt')
+corpusFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kenkenCorpus.txt')
+
+def readPuzzles(path, solutions = False):
+    """Yield a Board for each puzzle in a file, one at a time
+
+    With solutions yields (Board, solution or None) instead
+
+    Text puzzles start with a line holding just the size,
+    then a line per block, op result cell cell ...
+      4
+      - 1 0 1
+      + 3 2
+    Cells are flat indices, row * size + col
+    Lines starting with { hold a whole puzzle as JSON
+      {"size": 4, "blocks": [["-", 1, [0, 1]], ["+", 3, [2]], ...]}
+    and can hold a known "solution", numbers row by row as one string
+    # starts a comment, blank lines are skipped
+    """
+    def found(board, solution = None):
+        return (board, solution) if solutions else board
+    size = 0
+    blocks = []
+    with open(path, encoding='utf-8') as f:
+        for lineNumber, line in enumerate(f, 1):
+            line = line.split('#')[0].strip()
+            if not line:
                 continue
-            if num in c:
-                c.remove(num)
-                changes += 1
-        return changes
-
-    def removeFromCol(self, num, colIndex, exclude = []):
-        changes = 0
-        for i,r in enumerate([row[colIndex] for row in self.possible]):
-            if i in exclude:
+            if line.startswith('{'):
+                if size:
+                    yield found(Board(size, blocks))
+                    size = 0
+                puzzle = json.loads(line)
+                blocks = []
+                for op, result, cells in puzzle['blocks']:
+                    blocks += [op, result, cells]
+                yield found(Board(puzzle['size'], blocks), puzzle.get('solution'))
                 continue
-            # r is list so this is a reference
-            if num in r:
-                r.remove(num)
-                changes += 1
-        return changes
-
-    def getBlockIndicesForCell(self, row, col, sudokuGrid = 9):
-        """Return list of (row, col) indices for a block
+            parts = line.split()
+            if len(parts) == 1:
+                if size:
+                    yield found(Board(size, blocks))
+                size = int(parts[0])
+                blocks = []
+            elif size and len(parts) > 2:
+                blocks += [parts[0], int(parts[1]), [int(x) for x in parts[2:]]]
+            else:
+                raise ValueError("{} line {}: can't read '{}'".format(path, lineNumber, line))
+    if size:
+        yield found(Board(size, blocks))
 
-        Give a cell and return the block it belongs to
-        by calling getBlockIndices
-        """
-        blockX = (row // sudokuGrid) + 1 # 0 to 8 -> 0 + 1
-        blockY = (col // sudokuGrid) + 1
-        return self.getBlockIndices(blockX, blockY, sudokuGrid)
-
-    def getBlockIndicesFlat(self, blockX, blockY, sudokuGrid = 9):
-        """Return list of indices in a sudoku block.
-
-        block X,Y indices start from 0
-        Max grid X,Y is sqrt(sudokuGrid) - 1
-        For 9x9 sudoku, flat indexing is 0-80 in list of sudoku board
-        e.g. Block 0,0 should return [0, 1, 2, 9, 10, 11, 18, 19, 20]
-             0  1  2
-             9 10 11
-            18 19 20
-        """
-        blockSize = isqrt(sudokuGrid) # TODO Check for bad grid
-        indices = []
-        row0 = blockX * blockSize # 0, 1, 2 -> 0, 3, 6
-        col0 = blockY * blockSize
-        for row in range(row0, row0 + blockSize):
-            for col in range(col0, col0 + blockSize):
-                indices.append(row * sudokuGrid + col)
-        return indices
-
-    def removeFromBlock(self, num, blockX, blockY, exclude = []): # TODO Add sudokuGrid parameter everywhere?
-        """
+def solveBoard(board):
+    """Solve and time one board, the batch worker
 
-        NOTE: Expect exclude as tuples (row, col)
-        """
-        changes = 0
-        indices = self.getBlockIndices(blockX, blockY)
-        for c in indices:
-            if c in exclude:
+    Returns (solution or None, seconds)"""
+    p0 = perf_counter()
+    solved = board.playerSolver()
+    pT = perf_counter() - p0
+    return (board.solution() if solved else None), pT
+
+def filterBatch(boards):
+    """Narrow possible masks for many boards at once with NumPy
+
+    Boards of each size share a (boards, cells, numbers) bool tensor.
+    Rows and columns drop numbers set elsewhere and set hidden singles,
+    cages keep numbers that some still fitting tuple uses, all as whole tensor masks,
+    repeated until nothing changes. numbers and possible are written back to each board.
+    Returns a state per board
+      solved - every cell set, no search needed
+      open   - still needs a search like playerSolver
+      dead   - a cell ran out of numbers, no solution"""
+    import numpy as np # Only batch solving needs numpy
+    states = [None] * len(boards)
+    bySize = {}
+    for k, board in enumerate(boards):
+        bySize.setdefault(board.size, []).append(k)
+    for N, ks in bySize.items():
+        B, C = len(ks), N*N
+        # bits[m, v] is whether mask m holds number v+1
+        bits = (np.arange(1 << (N+1))[:, None] >> np.arange(1, N+1) & 1).astype(bool)
+        dom = bits[np.stack([np.frombuffer(boards[k].possible, dtype=np.uint16) for k in ks])]
+        # Cage tuple table, a row per tuple, cells index rows of flat, vals are number - 1
+        # Short cages are padded by repeating their first cell
+        width = max(len(c.cells) for k in ks for c in boards[k].blocks)
+        tables = {} # Padded vals per tuples, boards share tuples for the same blocks
+        cells = []
+        vals = []
+        counts = []
+        for b, k in enumerate(ks):
+            for c in boards[k].blocks:
+                pad = width - len(c.cells)
+                if id(c.tuples) not in tables:
+                    t = np.array(c.tuples, dtype=np.intp).reshape(len(c.tuples), len(c.cells)) - 1
+                    tables[id(c.tuples)] = (c.tuples, np.concatenate([t, np.repeat(t[:, :1], pad, axis=1)], axis=1))
+                vals.append(tables[id(c.tuples)][1])
+                cells.append([b*C + i for i in c.cells + c.cells[:1]*pad])
+                counts.append(len(c.tuples))
+        cells = np.repeat(np.array(cells, dtype=np.intp), counts, axis=0)
+        vals = np.concatenate(vals)
+        flat = dom.reshape(B*C, N)
+        grid = dom.reshape(B, N, N, N)
+        count = -1
+        while count != dom.sum():
+            count = dom.sum()
+            for axis in (1, 2): # Columns then rows
+                fixed = grid & (grid.sum(-1, keepdims=True) == 1)
+                grid &= (fixed.sum(axis, keepdims=True) - fixed) == 0
+                single = grid & (grid.sum(axis, keepdims=True) == 1)
+                grid[...] = np.where(single.any(-1, keepdims=True), single, grid)
+            fits = flat[cells, vals].all(1)
+            cells = cells[fits] # Tuples that stop fitting never fit again
+            vals = vals[fits]
+            used = np.zeros_like(flat)
+            used[cells, vals] = True
+            flat &= used
+        sizes = dom.sum(-1)
+        masks = (dom * (1 << np.arange(1, N+1))).sum(-1)
+        for b, k in enumerate(ks):
+            board = boards[k]
+            if (sizes[b] == 0).any():
+                states[k] = 'dead'
                 continue
-            row, col = c
-            cell = self.possible[row][col]
-            if num in cell:
-                print(self.possible[row][col])
-                cell.remove(num)
-                changes += 1
-                print(self.possible[row][col])
-        return changes
-
-    def playerSolver(self):
-        return NotImplementedError()
-        """Try to solve sudoku like a player would.
-
-        Check rows, columns, and blocks to find/rule out number placement.
-        Use backtracking when we need to guess."""
-        currNumber = 1
-        flatBoard = [n for row in self.numbers for n in row]
-        self.updatePossible()
-        cycles = 0
-        changed = True
-        while changed:
-            print(self)
-            changed = False
-            self.printPossible()
-            changes = self.updatePossible()
-            changes += self.trimPairsAndTriplets()
-            changes += self.trySetBoard()
-            changed = changes > 0
-            cycles += 1
-            print("{} cycles".format(cycles), end='\r')
-        print("")
+            board.possible = array('H', masks[b].tolist())
+            board.numbers[:] = bytes(np.where(sizes[b] == 1, dom[b].argmax(-1) + 1, 0).tolist())
+            states[k] = 'solved' if (sizes[b] == 1).all() else 'open'
+    return states
+
+def filtered(batch, states, results, share):
+    """Merge filterBatch boards back in with search results, in batch order"""
+    for board, state in zip(batch, states):
+        if state == 'open':
+            solution, pT = next(results)
+            yield solution, pT + share
+        else:
+            yield (board.solution() if state == 'solved' else None), share
+
+def solveFile(path, out = sys.stdout, jobs = 1, window = 256, statsPath = None, vectorize = False):
+    """Solve every puzzle in a file across jobs processes
+
+    Only window puzzles are read ahead at a time so big files stay small in memory.
+    Writes a line per puzzle in file order
+      count seconds solution
+    solution is the numbers row by row, or - if there is none
+    With vectorize each window goes through filterBatch first,
+    only boards it leaves open are searched, the others get an even share of its time
+    With statsPath each puzzle is raced by solvePortfolio instead, jobs is unused,
+    lines get the winning setup's name and the win counts are added to statsPath"""
+    if statsPath:
+        return solveFilePortfolio(path, out, statsPath)
+    puzzles = readPuzzles(path)
+    count = 0
+    solved = 0
+    p0 = perf_counter()
+    pool = Pool(jobs) if jobs > 1 else None
+    try:
+        while True:
+            batch = list(islice(puzzles, window))
+            if not batch:
+                break
+            states = ['open'] * len(batch)
+            if vectorize:
+                f0 = perf_counter()
+                states = filterBatch(batch)
+                share = (perf_counter() - f0) / len(batch)
+            search = [board for board, state in zip(batch, states) if state == 'open']
+            if pool:
+                results = pool.imap(solveBoard, search, chunksize=max(1, len(search) // (jobs*4)))
+            else:
+                results = map(solveBoard, search)
+            if vectorize:
+                results = filtered(batch, states, results, share)
+            for solution, pT in results:
+                count += 1
+                solved += solution is not None
+                out.write("{} {:.6f} {}\n".format(count, pT, solution or '-'))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    pT = perf_counter() - p0
+    out.write("# Solved {} of {} in {:.3f}s\n".format(solved, count, pT))
+
+# Solver setups raced by solvePortfolio, name: (engine, cell order, value order)
+portfolio = {
+    'propagate': ('playerSolver', 'cage', 'up'),
+    'propagate-tuples': ('playerSolver', 'cage', 'tuples'),
+    'cage': ('backtrack', 'cage', 'up'),
+    'degree-down': ('backtrack', 'degree', 'down'),
+    'backjump-tuples': ('backjump', 'cage', 'tuples'),
+    'dlx': ('dlx', 'cage', 'up'),
+    }
+
+def portfolioWorker(name, board, results):
+    """Run one portfolio setup, puts (name, solution or None, seconds) on results
+
+    Always puts something, even when the setup raises, so solvePortfolio never waits forever"""
+    p0 = perf_counter()
+    solution = None
+    try:
+        engine, board.order, board.values = portfolio[name]
+        if board.solve(engine):
+            solution = board.solution()
+    finally:
+        results.put((name, solution, perf_counter() - p0))
+
+def solvePortfolio(board, names = None, wins = None):
+    """Race portfolio setups on one board, each in its own process
+
+    The first solution wins and the other processes are stopped.
+    wins counts wins per setup name, pass the same dict to keep tuning stats
+    Returns (solution or None, winning setup name or None)"""
+    names = names or list(portfolio)
+    results = Queue()
+    workers = [Process(target=portfolioWorker, args=(name, board, results), daemon=True)
+               for name in names]
+    for w in workers:
+        w.start()
+    solution, winner = None, None
+    try:
+        for _ in workers:
+            name, solution, pT = results.get()
+            if solution is not None:
+                winner = name
+                break
+    finally:
+        for w in workers:
+            if w.is_alive():
+                w.terminate()
+            w.join()
+    if wins is not None and winner:
+        wins[winner] = wins.get(winner, 0) + 1
+    return solution, winner
+
+def loadWins(path):
+    """Portfolio win counts saved by saveWins, empty if there's no file yet"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def saveWins(path, wins):
+    with open(path, 'w') as f:
+        json.dump(wins, f, indent=1, sort_keys=True)
+
+def solveFilePortfolio(path, out, statsPath):
+    wins = loadWins(statsPath)
+    count = 0
+    solved = 0
+    p0 = perf_counter()
+    for board in readPuzzles(path):
+        b0 = perf_counter()
+        solution, winner = solvePortfolio(board, wins=wins)
+        count += 1
+        solved += solution is not None
+        out.write("{} {:.6f} {} {}\n".format(count, perf_counter() - b0, solution or '-', winner or '-'))
+    saveWins(statsPath, wins)
+    pT = perf_counter() - p0
+    out.write("# Solved {} of {} in {:.3f}s\n".format(solved, count, pT))
+    out.write("# Wins {}\n".format(json.dumps(wins, sort_keys=True)))
+
+def benchOrders(path = benchFile, orders = Board.orders, engines = ('backtrack', 'backjump')):
+    """Backtrack and backjump every bench board with each cell order
+
+    Prints nodes (numbers placed) and seconds per order and engine"""
+    for order in orders:
+        for engine in engines:
+            nodes = []
+            p0 = perf_counter()
+            for b in readPuzzles(path):
+                getattr(b, engine)(order=order)
+                nodes.append(b.nodes)
+            pT = perf_counter() - p0
+            print("{:>7} {:>9} {:>7} nodes {:8.3f}s  {}".format(order, engine, sum(nodes), pT, nodes))
+
+# backjump only pays off with the index order, which is far too slow on the 8x8 and 9x9 boards, see benchOrders
+sizesEngines = tuple(e for e in Board.engines if e != 'backjump')
+
+def benchSizes(path = sizesFile, engines = sizesEngines):
+    """Solve the sizes boards with each engine, checking every answer
+
+    Prints mean and worst seconds per board size so slow growth shows up"""
+    times = {}
+    for b in readPuzzles(path):
+        for engine in engines:
+            board = Board(b.size, b.toBlocks())
+            p0 = perf_counter()
+            board.solve(engine)
+            pT = perf_counter() - p0
+            if not board.isSolved():
+                raise RuntimeError("{} got a {}x{} board wrong".format(engine, b.size, b.size))
+            times.setdefault((engine, b.size), []).append(pT)
+    for (engine, size), t in sorted(times.items()):
+        print("{:>12} {}x{} {:9.4f}s mean {:9.4f}s worst".format(
+            engine, size, size, sum(t) / len(t), max(t)))
+
+def gitCommit():
+    """Short hash of the checked out commit, None outside a git repo"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(path = corpusFile, engines = Board.engines, repeats = 3, profileDir = None):
+    """Solve every corpus puzzle repeats times with each engine, no printing
+
+    Every answer is checked against the puzzle's known solution.
+    Per puzzle and engine keeps nodes, guesses, rule checks, best and mean seconds
+    and checks per second of the best run.
+    With profileDir each puzzle and engine gets 1 more, untimed, run under cProfile
+    saved as profileDir/engine-puzzle.prof, open it with pstats or snakeviz.
+    Returns a dict ready for json, sizes holds totals per engine and board size"""
+    if profileDir:
+        os.makedirs(profileDir, exist_ok=True)
+    results = {'commit': gitCommit(), 'python': platform.python_version(), 'path': path,
+               'repeats': repeats, 'puzzles': [], 'sizes': {}}
+    for n, (b, solution) in enumerate(readPuzzles(path, solutions=True), 1):
+        for engine in engines:
+            times = []
+            for _ in range(repeats):
+                board = Board(b.size, b.toBlocks())
+                p0 = perf_counter()
+                board.solve(engine)
+                times.append(perf_counter() - p0)
+            if not board.isSolved() or (solution and board.solution() != solution):
+                raise RuntimeError("{} got puzzle {} wrong".format(engine, n))
+            if profileDir:
+                profile = cProfile.Profile()
+                profile.runcall(Board(b.size, b.toBlocks()).solve, engine)
+                profile.dump_stats(os.path.join(profileDir, '{}-{}.prof'.format(engine, n)))
+            best = min(times)
+            results['puzzles'].append({
+                'puzzle': n, 'size': b.size, 'engine': engine,
+                'nodes': board.nodes, 'guesses': board.guesses, 'checks': board.checks,
+                'best': best, 'mean': sum(times) / len(times),
+                'checksPerSecond': board.checks / best if best else 0})
+            total = results['sizes'].setdefault('{} {}'.format(engine, b.size), {
+                'puzzles': 0, 'nodes': 0, 'guesses': 0, 'checks': 0, 'seconds': 0, 'worst': 0})
+            total['puzzles'] += 1
+            total['nodes'] += board.nodes
+            total['guesses'] += board.guesses
+            total['checks'] += board.checks
+            total['seconds'] += best
+            total['worst'] = max(total['worst'], best)
+    return results
+
+def printBenchmark(results, old = None):
+    """Print benchmark totals per engine and size
+
+    With old results from an earlier run, time ratios are added
+    and changed node or guess counts are flagged, the search itself changed"""
+    print("# commit {} python {} repeats {}".format(results['commit'], results['python'], results['repeats']))
+    for key, t in sorted(results['sizes'].items(), key=lambda kv: (kv[0].split()[0], int(kv[0].split()[1]))):
+        engine, size = key.split()
+        line = "{:>12} {}x{} {:9.4f}s mean {:9.4f}s worst {:8} nodes {:6} guesses {:10.0f} checks/s".format(
+            engine, size, size, t['seconds'] / t['puzzles'], t['worst'], t['nodes'], t['guesses'],
+            t['checks'] / t['seconds'] if t['seconds'] else 0)
+        o = (old or {}).get('sizes', {}).get(key)
+        if o:
+            line += " {:6.2f}x time".format(t['seconds'] / o['seconds'] if o['seconds'] else 0)
+            if (o['nodes'], o['guesses']) != (t['nodes'], t['guesses']):
+                line += " SEARCH CHANGED was {} nodes {} guesses".format(o['nodes'], o['guesses'])
+        print(line)
 
 def run():
     testBoard = [
@@ -481,14 +742,68 @@ def run():
     p0 = perf_counter()
     b = Board(6, testBoard)
     print(b)
-    b.backtrack(1, 0)
+    b.playerSolver()
     print(b)
     pT = perf_counter() - p0
-    print("Backtrack", pT)
+    guesses = b.guesses
+    b0 = perf_counter()
+    b = Board(6, testBoard)
+    print(b)
+    b.backtrack(1, 0)
+    print(b)
+    bT = perf_counter() - b0
+    print("PlaySolver", pT, "guesses", guesses)
+    print("Backtrack", bT)
 
 
 
 if __name__ == "__main__":
-    print("Howdy.")
-    run()
-
+    import argparse
+    parser = argparse.ArgumentParser(description="Kenken solver")
+    parser.add_argument('puzzles', nargs='?', help="file of puzzles to solve, see readPuzzles")
+    parser.add_argument('-o', '--output', help="write solutions here instead of printing them")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('-b', '--bench', action='store_true', help="compare backtrack and backjump cell orders")
+    parser.add_argument('-s', '--sizes', action='store_true', help="time 3x3 to 9x9 boards")
+    parser.add_argument('--benchmark', metavar='JSON', help="benchmark every engine on kenkenCorpus.txt, results to JSON")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per puzzle and engine for --benchmark")
+    parser.add_argument('--profile', metavar='DIR', help="cProfile stats per puzzle and engine for --benchmark")
+    parser.add_argument('--compare', metavar='JSON', help="earlier --benchmark results to compare against")
+    parser.add_argument('-n', '--numpy', action='store_true',
+                        help="filter each window of puzzles together with NumPy before searching")
+    parser.add_argument('-p', '--portfolio', metavar='STATS',
+                        help="race solver setups on each puzzle, keeping win counts in STATS json")
+    parser.add_argument('-g', '--generate', type=int, metavar='COUNT', help="make COUNT unique puzzles")
+    parser.add_argument('--size', type=int, default=6, help="board size for --generate")
+    parser.add_argument('--seed', type=int, default=0, help="seed for --generate")
+    args = parser.parse_args()
+    if args.generate:
+        if args.output:
+            with open(args.output, 'w') as out:
+                generateFile(args.size, args.generate, args.seed, out, args.jobs)
+        else:
+            generateFile(args.size, args.generate, args.seed, jobs=args.jobs)
+    elif args.puzzles:
+        if args.output:
+            with open(args.output, 'w') as out:
+                solveFile(args.puzzles, out, args.jobs, statsPath=args.portfolio, vectorize=args.numpy)
+        else:
+            solveFile(args.puzzles, jobs=args.jobs, statsPath=args.portfolio, vectorize=args.numpy)
+    elif args.benchmark:
+        results = benchmark(repeats=args.repeat, profileDir=args.profile)
+        with open(args.benchmark, 'w') as f:
+            json.dump(results, f, indent=1)
+        old = None
+        if args.compare:
+            with open(args.compare) as f:
+                old = json.load(f)
+        printBenchmark(results, old)
+    elif args.bench:
+        print("Howdy.")
+        benchOrders()
+    elif args.sizes:
+        print("Howdy.")
+        benchSizes()
+    else:
+        print("Howdy.")
+        run()
@@ -21,14 +21,26 @@ Lose, remove the 1 of each beads used.
 Moves will just be a list counter
 beads[0] = # of beads for placing in top left
 total odds = sum(beads)
-choice = random(total odds)
+choice = random(total odds), random.choices weighted by the counts
+
+Every matchbox board a game can reach is listed once up front and gets a dense box id,
+beads for all of them sit in 1 flat array, 9 counts per box
 """
 
+import os
+import sys
+import mmap
+import struct
+import csv
+import json
+import subprocess
+from time import perf_counter
 from enum import IntEnum
-from random import choice
-import matplotlib.pyplot as plt
+import random
+from random import Random
+from functools import partial
+from array import array
 
-boards = {}
 """
 Board is represented as 18 bits in an int
 9 board positions
@@ -37,33 +49,6 @@ Board is represented as 18 bits in an int
 So bit shift >> | 3 => X in space
 bit shift >> | 2 => O in space
 """
-class Matchbox:
-    startingBeads = 50
-    def __init__(self):
-        self.layout = 0 # 18 bits
-        self.symmetric = set()
-        self.beadsX = [x for x in range(9)]*Matchbox.startingBeads
-        # 001122334455667788
-        # 2 of each bead, to choose
-        self.beadsO = [x for x in range(9)]*Matchbox.startingBeads
-
-    def clearInvalidMoves(self):
-        b = intToBoard(self.layout)
-        for i in range(9):
-            if b[i] != '':
-                while i in self.beadsX:
-                    self.beadsX.remove(i)
-                while i in self.beadsO:
-                    self.beadsO.remove(i)
-
-
-def addMatchbox(number, boards, bset = set()):
-    if number not in boards:
-        boards[number] = Matchbox()
-        boards[number].layout = number
-        boards[number].symmetric = bset
-        boards[number].clearInvalidMoves()
-
 def boardToInt(board):
     """board is array of X or O"""
     n = 0
@@ -100,176 +85,103 @@ def printBoard(board):
             ---+---+---
              {board[6]:>1} | {board[7]:>1} | {board[8]:>1}""")
 
-def rotate(boardNumber):
-    b = intToBoard(boardNumber)
-    # 012   630
-    # 345 = 741
-    # 678   852
-    b[0], b[1], b[2], b[5], b[8], b[7], b[6], b[3] = b[6], b[3], b[0], b[1], b[2], b[5], b[8], b[7]
-    return boardToInt(b)
-
-def mirror0(boardNumber):
-    """Horizontal"""
-    b = intToBoard(boardNumber)
-    # 012   678
-    # 345 = 345
-    # 678   012
-    b[0], b[1], b[2], b[6], b[7], b[8] = b[6], b[7], b[8], b[0], b[1], b[2]
-    return boardToInt(b)
-
-def mirror1(boardNumber):
-    """Vertical"""
-    b = intToBoard(boardNumber)
-    # 012   210
-    # 345 = 543
-    # 678   876
-    b[0], b[2], b[3], b[5], b[6], b[8] = b[2], b[0], b[5], b[3], b[8], b[6]
-    return boardToInt(b)
-
-def mirror2(boardNumber):
-    """Diagonal /"""
-    b = intToBoard(boardNumber)
-    # 012   852
-    # 345 = 741
-    # 678   630
-    b[0], b[1], b[3], b[5], b[7], b[8] = b[8], b[5], b[7], b[1], b[3], b[0]
-    return boardToInt(b)
-    
-def mirror3(boardNumber):
-    """Diagonal \\"""
-    b = intToBoard(boardNumber)
-    # 012   036
-    # 345 = 147
-    # 678   258
-    b[1], b[2], b[3], b[5], b[6], b[7] = b[3], b[6], b[1], b[7], b[2], b[5]
-    return boardToInt(b)
-
-def getOperations(ref, target):
-    ops = []
-    r = ref
-    for x in range(3):
-        r = rotate(r)
-        ops.append(0)
-        if r == target:
-            return ops
-    ops = [1]
-    r = mirror0(ref) # horizontal reflection
-    if r == target:
-        return ops
-    for x in range(3):
-        r = rotate(r)
-        ops.append(0)
-        if r == target:
-            return ops
-    ops = [2]
-    r = mirror1(ref) # vertical reflection
-    if r == target:
-        return ops
-    for x in range(3):
-        r = rotate(r)
-        ops.append(0)
-        if r == target:
-            return ops
-    ops = [3]
-    r = mirror2(ref) # diagonal reflection /
-    if r == target:
-        return ops
-    for x in range(3):
-        r = rotate(r)
-        ops.append(0)
-        if r == target:
-            return ops
-    ops = [4]
-    r = mirror3(ref) # diagonal reflection \\
-    if r == target:
-        return ops
-    for x in range(3):
-        r = rotate(r)
-        ops.append(0)
-        if r == target:
-            return ops
-    raise RuntimeError(f"Unrelated boards are grouped {ref} {target}")
-
-# Dictionary results of sym operations
-symOps = {
-    0:{ # rot
-        0:2,
-        1:5,
-        2:8,
-        3:1,
-        5:7,
-        6:0,
-        7:3,
-        8:6
-    },
-    1:{ # horizontal mirror
-        0:6,
-        1:7,
-        2:8,
-        6:0,
-        7:1,
-        8:2
-    },
-    2:{ # vert
-        0:2,
-        2:0,
-        3:5,
-        5:3,
-        6:8,
-        8:6
-    },
-    3:{ # diag /
-        0:8,
-        1:5,
-        3:7,
-        5:1,
-        7:3,
-        8:0
-    },
-    4:{ # diag \\
-        1:3,
-        2:6,
-        3:1,
-        5:7,
-        6:2,
-        7:5
-    }
-    }
-
-def applyOps(choice, ops):
-    """Move a 3x3 grid position by rotation or mirroring"""
-    c = choice
-    for o in ops:
-        if c in symOps[o]:
-            c = symOps[o][c]
-    return c
-
-
-
-def transform(choice, referenceBoard, playBoard):
-    """Matchbox beads are for the matchbox ref board.
-    Need to rotate/reflect the choice to the play board."""
-    if choice == 4 or referenceBoard == playBoard: # Center unchanging
-        return choice
-    ops = getOperations(referenceBoard, playBoard)
-    return applyOps(choice, ops)
-
-def getBoardSet(boardNumber):
-    s = set()
-    a = boardNumber
-    b = mirror0(a)
-    c = mirror1(a)
-    d = mirror2(a)
-    e = mirror3(a)
-    s |= set([a,b,c,d,e])
-    for i in range(3):
-        a = rotate(a)
-        b = rotate(b)
-        c = rotate(c)
-        d = rotate(d)
-        e = rotate(e)
-        s |= set([a,b,c,d,e])
-    return min(s), s
+"""
+Symmetries
+8 ways to turn a board into one that plays the same, a position permutation each.
+Board b turns into c with c[i] = b[perm[i]], so position i of c is position perm[i] of b
+and position p of b is position inverse[p] of c.
+"""
+symmetries = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8), # Same
+    (6, 3, 0, 7, 4, 1, 8, 5, 2), # Rotate once  630 741 852
+    (8, 7, 6, 5, 4, 3, 2, 1, 0), # Rotate twice
+    (2, 5, 8, 1, 4, 7, 0, 3, 6), # Rotate 3 times
+    (6, 7, 8, 3, 4, 5, 0, 1, 2), # Horizontal mirror  678 345 012
+    (0, 3, 6, 1, 4, 7, 2, 5, 8), # Diagonal \\ mirror  036 147 258
+    (2, 1, 0, 5, 4, 3, 8, 7, 6), # Vertical mirror  210 543 876
+    (8, 5, 2, 7, 4, 1, 6, 3, 0), # Diagonal / mirror  852 741 630
+    )
+inverses = tuple(tuple(perm.index(p) for p in range(9)) for perm in symmetries)
+
+"""
+Canonical board table
+The matchbox board is the smallest 18 bit number of the 8 symmetric boards.
+Boards get a compact state id, base 3 digits per position 0 empty 1 X 2 O,
+so all 3^9 boards fit flat arrays indexed by state id
+  canonBoard[id] - matchbox board number
+  canonSym[id] - index into symmetries that turns the board into its matchbox board
+  boxOf[id] - dense box id of the board's matchbox, -1 if the game is over
+boxBoards[box] is the matchbox board number of a box, box 0 is the empty board
+"""
+nStates = 3**9
+# State id of 3 positions from their 6 bits, 0 1 or 2 per position like the 2 bit codes 0 2 3
+chunkState = [0] * 64
+for bits in range(64):
+    for j in range(3):
+        code = bits >> (2*j) & 3
+        chunkState[bits] += (0, 0, 2, 1)[code] * 3**j
+
+def stateId(boardNumber):
+    """Base 3 state id of an 18 bit board number"""
+    return chunkState[boardNumber & 63] + 27 * chunkState[boardNumber >> 6 & 63] \
+        + 729 * chunkState[boardNumber >> 12 & 63]
+
+powers3 = tuple(3**i for i in range(9))
+canonBoard = None
+canonSym = None
+boxOf = None
+boxBoards = None
+
+def buildTables():
+    """Fill the canonical and box tables, once"""
+    global canonBoard, canonSym, boxOf, boxBoards
+    if canonBoard is not None:
+        return
+    codes = (0, 3, 2) # State digit to 2 bit code
+    # Build lists over every state id a position at a time, digit d of position j adds d*3^j
+    numbers = [0]
+    for j in range(9):
+        numbers = [n | codes[d] << (2*j) for d in range(3) for n in numbers]
+    moved = [] # Board numbers after each symmetry, digit j goes to position inverse[j]
+    for inverse in inverses:
+        ids = [0]
+        for j in range(9):
+            ids = [v + d*powers3[inverse[j]] for d in range(3) for v in ids]
+        moved.append([numbers[v] for v in ids])
+    table = array('l', [0]) * nStates
+    syms = bytearray(nStates)
+    for sid, options in enumerate(zip(*moved)):
+        best = min(options)
+        table[sid] = best
+        syms[sid] = options.index(best)
+    canonBoard, canonSym = table, syms
+    # Walk every game from the empty board, each new matchbox board gets the next box id
+    boxes = array('l', [0])
+    index = {0: 0}
+    k = 0
+    while k < len(boxes):
+        number = boxes[k]
+        k += 1
+        xMask, oMask = boardMasks(number)
+        xTurn = bin(xMask).count('1') == bin(oMask).count('1')
+        for pos in range(9):
+            if (xMask | oMask) >> pos & 1:
+                continue
+            if xTurn:
+                child = number | 3 << (2*pos)
+                result = checkMasks(xMask | 1 << pos, oMask)
+            else:
+                child = number | 2 << (2*pos)
+                result = checkMasks(xMask, oMask | 1 << pos)
+            if result != GameResult.PLAY:
+                continue
+            c = canonBoard[stateId(child)]
+            if c not in index:
+                index[c] = len(boxes)
+                boxes.append(c)
+    boxOf = array('h', [index.get(c, -1) for c in canonBoard])
+    boxBoards = boxes
+
 
 class GameResult(IntEnum):
     PLAY = 0
@@ -278,47 +190,176 @@ class GameResult(IntEnum):
     O = 3
 
 
-def checkBoard(boardNumber):
-    b = intToBoard(boardNumber)
-    if b[0] == b[4] == b[8] == '':
-        return GameResult.PLAY
-    r0 = b[:3]
-    r1 = b[3:6]
-    r2 = b[6:]
-    c0 = b[::3]
-    c1 = b[1::3]
-    c2 = b[2::3]
-    d0 = b[::4]
-    d1 = b[2:7:2]
-    openMove = False
-    for x in (r0, r1, r2, c0, c1, c2, d0, d1):
-        nX = x.count('X')
-        if nX == 3:
+"""
+Bitboards
+X and O each get a 9 bit mask, bit i set means their piece is in position i
+"""
+# Rows, columns and diagonals as 9 bit masks
+winMasks = tuple(sum(1 << i for i in line) for line in (
+    (0, 1, 2), (3, 4, 5), (6, 7, 8),
+    (0, 3, 6), (1, 4, 7), (2, 5, 8),
+    (0, 4, 8), (2, 4, 6)))
+
+# 9 bit masks of 3 positions from their 6 bits, X is code 3 and O is code 2
+chunkX = [sum(1 << j for j in range(3) if bits >> (2*j) & 3 == 3) for bits in range(64)]
+chunkO = [sum(1 << j for j in range(3) if bits >> (2*j) & 3 == 2) for bits in range(64)]
+
+def boardMasks(boardNumber):
+    """X and O masks of an 18 bit board"""
+    a, b, c = boardNumber & 63, boardNumber >> 6 & 63, boardNumber >> 12 & 63
+    return chunkX[a] | chunkX[b] << 3 | chunkX[c] << 6, chunkO[a] | chunkO[b] << 3 | chunkO[c] << 6
+
+def masksBoard(xMask, oMask):
+    """18 bit board of X and O masks, only needed to show or prompt a board"""
+    return sum(3 << (2*i) for i in range(9) if xMask >> i & 1) | sum(2 << (2*i) for i in range(9) if oMask >> i & 1)
+
+def checkMasks(xMask, oMask):
+    """Game result from X and O masks
+
+    A line is open until it holds both an X and an O,
+    no open lines left is a draw before the board fills"""
+    openLine = False
+    for w in winMasks:
+        x = xMask & w
+        o = oMask & w
+        if x == w:
             return GameResult.X
-        nO = x.count('O')
-        if nO == 3:
+        if o == w:
             return GameResult.O
-        nB = x.count('')
-        if nB > 1 or nX == 0 or nO == 0:
-            openMove = True
-        if nB == 1 and (nX == 2 or nO == 2):
-            openMove = True
-    if not openMove:
+        if not (x and o):
+            openLine = True
+    if not openLine:
         return GameResult.DRAW
     return GameResult.PLAY
 
-def updateBoard(char, board, pos):
-    b = intToBoard(board)
-    if b[pos] != '':
-        print(char, pos)
-        raise RuntimeError("Position occupied")
-    b[pos] = char
-    return boardToInt(b)
+def checkBoard(boardNumber):
+    return checkMasks(*boardMasks(boardNumber))
+
+"""
+Beads
+beads[9*box + pos] is the number of beads for pos in a box,
+only the player to move on a box's board ever draws from it
+"""
+startingBeads = 50
+rewards = {GameResult.DRAW: (1, 1), GameResult.X: (3, -1), GameResult.O: (-1, 3)} # X and O beads per result
+
+def initialBeads():
+    """startingBeads for each open position of every box"""
+    buildTables()
+    beads = array('l', [0]) * (9*len(boxBoards))
+    for box, number in enumerate(boxBoards):
+        for pos in range(9):
+            if not number >> (2*pos) & 3:
+                beads[9*box + pos] = startingBeads
+    return beads
+
+def addBeads(beads, moves, n, boxSums = None):
+    """Add n beads for each (box, position) move, negative n takes beads away down to 0
+
+    Returns the change in total beads, boxSums gets the change for each box when given"""
+    total = 0
+    for box, pos in moves:
+        i = 9*box + pos
+        old = beads[i]
+        beads[i] = max(0, old + n)
+        total += beads[i] - old
+        if boxSums is not None:
+            boxSums[box] += beads[i] - old
+    return total
+
+"""
+Save file, little endian
+  header  b'MENC', version, 0, box count
+  boards  a uint32 matchbox board number per box, in box id order
+  beads   9 uint32 counts per box
+"""
+saveMagic = b'MENC'
+saveVersion = 1
+saveHeader = struct.Struct('<4sHHI')
+
+def saveBeads(path, beads, extra = b''):
+    """Write beads to path, through a temp file so a loaded mmap of path stays good
+
+    extra bytes go after the beads, loadBeads skips them"""
+    buildTables()
+    numbers = array('I', boxBoards)
+    counts = array('I', beads)
+    if sys.byteorder != 'little':
+        numbers.byteswap()
+        counts.byteswap()
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(saveHeader.pack(saveMagic, saveVersion, 0, len(numbers)))
+        numbers.tofile(f)
+        counts.tofile(f)
+        f.write(extra)
+    os.replace(tmp, path)
+
+"""
+Checkpoints
+A bead save file with the play state as json after the beads, so it loads with --load too.
+Written whole through a temp file and os.replace, a run killed mid write keeps the last one.
+The beads are 25KB so a full write is cheaper than working out what changed
+"""
+def saveCheckpoint(path, beads, state):
+    """Save beads and a json ready state dict to path"""
+    saveBeads(path, beads, json.dumps(state).encode())
+
+def loadCheckpoint(path):
+    """Beads and state dict from saveCheckpoint"""
+    beads = array('l', loadBeads(path))
+    with open(path, 'rb') as f:
+        data = f.read()
+    count = saveHeader.unpack_from(data)[3]
+    return beads, json.loads(data[saveHeader.size + 40*count:])
+
+def loadBeads(path):
+    """Beads from a saveBeads file
+
+    The file is mmapped copy on write, when its boxes are in box id order
+    the bead counts are used in place without copying them out or touching the file.
+    Other orders, or only some boxes, are copied into initialBeads,
+    boards that aren't boxes here are skipped"""
+    buildTables()
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    if len(data) < saveHeader.size:
+        raise ValueError(f"{path} is too short for a menace save")
+    magic, version, _, count = saveHeader.unpack_from(data)
+    if magic != saveMagic:
+        raise ValueError(f"{path} isn't a menace save")
+    if version != saveVersion:
+        raise ValueError(f"{path} is save version {version}, can only load {saveVersion}")
+    if len(data) < saveHeader.size + 40*count:
+        raise ValueError(f"{path} is cut short, {len(data)} bytes for {count} boxes")
+    view = memoryview(data)[saveHeader.size:saveHeader.size + 40*count]
+    if sys.byteorder == 'little':
+        numbers = view[:4*count].cast('I')
+        counts = view[4*count:].cast('I')
+    else:
+        numbers = array('I', view[:4*count])
+        counts = array('I', view[4*count:])
+        numbers.byteswap()
+        counts.byteswap()
+    if list(numbers) == list(boxBoards):
+        return counts
+    beads = initialBeads()
+    for k, number in enumerate(numbers):
+        box = boxOf[stateId(number)]
+        if box < 0 or boxBoards[box] != number:
+            continue
+        row = array('l', counts[9*k:9*k+9])
+        if len(row) != 9:
+            raise ValueError(f"{path} has {len(row)} beads for board {number}")
+        beads[9*box:9*box+9] = row
+    return beads
 
 
 class PlayerType(IntEnum):
     CHUMP = 1
     BOT = 2
+    PERFECT = 3
+    RANDOM = 4
 
 def getInt(minV, maxV):
     while True:
@@ -343,200 +384,572 @@ def promptTurn(board, char):
         choice = getInt(min(choices), max(choices))
     return choice
 
-def menaceChoose(board, boards, isX):
-    b, bset = getBoardSet(board) # Get common symmetry
-    if b not in boards:
-        addMatchbox(b, boards, bset)
-    if isX:
-        #print(set(boards[b].beadsX))
-        try:
-            c = choice(boards[b].beadsX)
-        except:
-            print(set(boards[b].beadsX))
-            printBoard(intToBoard(board))
-            raise
-        return transform(c, b, board)
-    else:
-        #print(set(boards[b].beadsO))
-        try:
-            c = choice(boards[b].beadsO)
-        except:
-            print(set(boards[b].beadsO))
-            printBoard(intToBoard(board))
-            raise
-        return transform(c, b, board)
-
-def plot(beadList, O):
-    plt.subplots()
-    zero = beadList[0]
-    y = [b-zero for b in beadList]
-    x = list(range(1, len(beadList)+1))
-    plt.plot(x, y, 'bx', label='X')
-    zero = O[0]
-    y = [b-zero for b in O]
-    x = list(range(1, len(O)+1))
-    plt.plot(x, y, 'ro', label='O')
-    plt.legend()
-    plt.title("Menace")
-    plt.ylabel("beads 3xwin + draws - loses")
-    plt.xlabel("games")
-    plt.savefig('menace.png')
-
-def plotBoards(n):
-    plt.subplots()
-    y = n
-    x = list(range(1, len(n)+1))
-    plt.plot(x, y, 'b.', label='Boards')
-    plt.title("Menace Symmetry Reduced Boards Played On")
-    plt.ylabel("Boards")
-    plt.xlabel("Games")
-    plt.savefig('menaceboards.png')
-
+"""
+Moves
+Every game, trained or not, goes through runGame so the rules live in 1 place.
+A chooser is f(sid, xMask, oMask, rng) giving a play board position, or None to resign
+"""
+resigned = (GameResult.O, GameResult.X) # Result when X or O resigns
+
+def menaceChoose(beads, sid, xMask = 0, oMask = 0, rng = None):
+    """Draw a bead from the matchbox of state id sid, returns a play board position
+    or None when the matchbox is empty and menace resigns"""
+    box = boxOf[sid]
+    counts = beads[9*box:9*box+9]
+    if not any(counts):
+        return None
+    c = (rng or random).choices(range(9), counts)[0]
+    return symmetries[canonSym[sid]][c] # Matchbox position to play board
+
+def menaceChooser(beads):
+    """Chooser drawing beads from beads"""
+    return partial(menaceChoose, beads)
+
+def runGame(choosers, rng = None):
+    """Play 1 game with X and O choosers
+
+    Returns (result, moves, xMask, oMask), moves holds X and O lists of (box, matchbox position)"""
+    sid = 0
+    xMask = 0
+    oMask = 0
+    moves = ([], [])
+    turn = 0
+    state = GameResult.PLAY
+    while state == GameResult.PLAY:
+        pos = choosers[turn](sid, xMask, oMask, rng)
+        if pos is None:
+            state = resigned[turn]
+            break
+        # Save moves using base/ref symmetry board
+        moves[turn].append((boxOf[sid], inverses[canonSym[sid]][pos]))
+        if turn:
+            oMask |= 1 << pos
+            sid += 2*powers3[pos]
+        else:
+            xMask |= 1 << pos
+            sid += powers3[pos]
+        state = checkMasks(xMask, oMask)
+        turn ^= 1
+    return state, moves, xMask, oMask
+
+def chooser(player, char, beads):
+    """Chooser for a PlayerType"""
+    if player == PlayerType.CHUMP:
+        return lambda sid, xMask, oMask, rng: promptTurn(masksBoard(xMask, oMask), char)
+    if player in opponents:
+        return opponents[player]
+    return menaceChooser(beads)
 
+"""
+Metrics
+play writes a CSV row every few games, menacePlot reads the rows back afterwards
+so memory stays the same however many games are played
+"""
+metricsFields = ('game', 'draws', 'xWins', 'oWins', 'box0', 'box1', 'boards', 'beads')
 
 def prompt():
     print("Tic tac toe MENACE")
     print("Who plays first as X?")
-    print("1. You,  2. Computer")
-    first = getInt(1, 2)
+    print("1. You,  2. Computer,  3. Perfect,  4. Random")
+    first = getInt(1, 4)
     print("Who goes second as O?")
-    print("1. You,  2. Computer")
-    second = getInt(1, 2)
+    print("1. You,  2. Computer,  3. Perfect,  4. Random")
+    second = getInt(1, 4)
     if first == second == 2:
         print("Computer battle!")
     print("How many rounds?")
     rounds = getInt(1, 999999999)
     return (first,second,rounds)
 
-def play(A, B, rounds, quiet = False, debug = True):
-    print(f"Players {PlayerType(A).name} v {PlayerType(B).name}  {rounds} rounds  Go!")
-    boards = {} # Holds matchboxes
-    # Tracking results for plotting
-    box0Beads = []
-    results = []
-    box1Beads = []
-    box1s = []
-    nb = []
-    for i in range(9):
-        box1s.append(3 << (2*i))
+def play(A, B, rounds, quiet = False, debug = True, beads = None, metrics = None, every = 1, evaluator = None,
+         checkpoint = None, checkpointEvery = 10000, resume = False):
+    """Play rounds games, beads holds matchboxes to keep training, returns them
+
+    With a metrics path a CSV row is written every few games, see menacePlot.
+    With a checkpoint path the beads, random state, counters and metrics file size
+    are saved every checkpointEvery games, resume carries on from it exactly,
+    players, rounds (unless given) and metrics come from the checkpoint"""
+    if every < 1 or checkpointEvery < 1:
+        raise ValueError(f"every and checkpointEvery have to be at least 1, not {every} and {checkpointEvery}")
+    buildTables()
     played = 0
+    results = [0, 0, 0] # draws, X wins, O wins
+    used = bytearray(len(boxBoards))
+    if resume:
+        beads, saved = loadCheckpoint(checkpoint)
+        A, B, every, metrics = saved['players'][0], saved['players'][1], saved['every'], saved['metrics']
+        rounds = rounds or saved['rounds']
+        played, results = saved['played'], saved['results']
+        if rounds < played:
+            raise ValueError(f"{checkpoint} is already at game {played}, past {rounds} rounds")
+        used[:] = bytes.fromhex(saved['used'])
+        random.setstate((saved['random'][0], tuple(saved['random'][1]), saved['random'][2]))
+        print(f"Resuming from {checkpoint} at game {played}")
+    print(f"Players {PlayerType(A).name} v {PlayerType(B).name}  {rounds} rounds  Go!")
+    beads = initialBeads() if beads is None else beads # Holds matchboxes
+    # Running totals for the metrics
+    boxSums = array('l', (sum(beads[9*box:9*box+9]) for box in range(len(boxBoards))))
+    totalBeads = sum(boxSums)
+    box1s = sorted({boxOf[powers3[i]] for i in range(9)}) # Boxes after X's first move
+    nUsed = sum(used)
+    out = None
+    if metrics and resume:
+        out = open(metrics, 'r+', newline='')
+        out.truncate(saved['metricsOffset']) # Rows after the checkpoint get played again
+        out.seek(saved['metricsOffset'])
+        writer = csv.writer(out)
+    elif metrics:
+        out = open(metrics, 'w', newline='')
+        writer = csv.writer(out)
+        writer.writerow(metricsFields)
+    players = (chooser(A, 'X', beads), chooser(B, 'O', beads))
     while played < rounds:
         # Entire game here
         played += 1
-        firstPlayer = True # False in 2nd player's turn
-        Xmoves = []
-        Omoves = []
-        state = GameResult.PLAY
-        board = 0
-        beads = 0
-        for v in boards.values():
-            beads += len(v.beadsX) + len(v.beadsO)
         if not quiet:
-            print(f"Played: {played}, boards: {len(boards)}, beads: {beads}")
-        # move = (board, placement)
-        while state == GameResult.PLAY:
-            # Take turns until finished
-            #printBoard(intToBoard(board))
-
-            b, bset = getBoardSet(board) # Get common symmetry
-            # Save moves using base/ref symmetry board
-            if firstPlayer:
-                choice = -1
-                basec = -1
-                if A == PlayerType.CHUMP:
-                    choice = promptTurn(board, 'X')
-                else:
-                    choice = menaceChoose(board, boards, isX=True)
-                Xmoves.append((b, transform(choice, board, b)))
-                board = updateBoard('X', board, choice)
-            else:
-                choice = -1
-                if B == PlayerType.CHUMP:
-                    choice = promptTurn(board, 'O')
-                else:
-                    choice = menaceChoose(board, boards, isX=False)
-                Omoves.append((b, transform(choice, board, b)))
-                board = updateBoard('O', board, choice)
-            state = checkBoard(board)
-            firstPlayer = not firstPlayer # Switch turn
+            print(f"Played: {played}, boards: {nUsed}, beads: {totalBeads}")
+        state, (Xmoves, Omoves), xMask, oMask = runGame(players)
+        for box, _ in Xmoves + Omoves:
+            if not used[box]: # A box menace resigns at lost its beads in earlier games, so it's counted already
+                used[box] = 1
+                nUsed += 1
         # Process results
-        if state == GameResult.DRAW:
-            if not quiet:
-                print("DRAW!")
-                printBoard(intToBoard(board))
-            results.append(0)
-            # Add 1 bead to all choices
-            for x in Xmoves:
-                b, pos = x
-                if b not in boards:
-                    addMatchbox(b, boards)
-                boards[b].beadsX.append(pos)
-            for o in Omoves:
-                b, pos = o
-                if b not in boards:
-                    addMatchbox(b, boards)
-                boards[b].beadsO.append(pos)
-        elif state == GameResult.X:
-            if not quiet:
-                print("X won!")
-                printBoard(intToBoard(board))
-            # Add 3 beads to all choices
-            results.append(1)
-            for x in Xmoves:
-                b, pos = x
-                if b not in boards:
-                    addMatchbox(b, boards)
-                boards[b].beadsX.append(pos)
-                boards[b].beadsX.append(pos)
-                boards[b].beadsX.append(pos)
-            # Remove 1 bead of all choices
-            for o in Omoves:
-                b, pos = o
-                if b not in boards:
-                    addMatchbox(b, boards)
-                boards[b].beadsO.remove(pos)
-        else: # Assume O wins
+        if not quiet:
+            print({GameResult.DRAW: "DRAW!", GameResult.X: "X won!", GameResult.O: "O won!"}[state])
+            printBoard(intToBoard(masksBoard(xMask, oMask)))
+        # Win 3 beads to all choices, draw 1, lose -1
+        results[state - 1] += 1
+        xReward, oReward = rewards[state]
+        totalBeads += addBeads(beads, Xmoves, xReward, boxSums)
+        totalBeads += addBeads(beads, Omoves, oReward, boxSums)
+        if out and (played % every == 0 or played == rounds):
+            box1 = sum(boxSums[box] for box in box1s)
+            writer.writerow((played, *results, boxSums[0], box1, nUsed, totalBeads))
+        if evaluator:
+            evaluator.update(played, beads)
+        if checkpoint and (played % checkpointEvery == 0 or played == rounds):
+            if out:
+                out.flush()
+            saveCheckpoint(checkpoint, beads, {
+                'players': [int(A), int(B)], 'rounds': rounds, 'played': played, 'results': results,
+                'used': used.hex(), 'every': every, 'metrics': metrics,
+                'metricsOffset': out.tell() if out else 0, 'random': random.getstate()})
+    if out:
+        out.close()
+    return beads
+
+
+"""
+Parallel training
+Each worker plays a batch of bot v bot games on its own copy of a bead snapshot
+with its own seeded Random, and sends back only the beads that changed.
+The coordinator adds every worker's changes to the snapshot and hands the new one out again.
+sync is games per worker between merges, fewer means workers see each others learning sooner
+"""
+def selfPlay(beads, games, rng):
+    """Play games bot v bot updating beads, returns counts of (draws, X wins, O wins)"""
+    counts = [0, 0, 0]
+    players = (menaceChooser(beads),) * 2
+    for _ in range(games):
+        state, moves, _, _ = runGame(players, rng)
+        xReward, oReward = rewards[state]
+        addBeads(beads, moves[0], xReward)
+        addBeads(beads, moves[1], oReward)
+        counts[state - 1] += 1
+    return counts
+
+def trainWorker(task):
+    """Play a batch on a snapshot, returns (changed indices, bead changes, result counts)"""
+    snapshot, games, seed = task
+    buildTables()
+    beads = array('l', snapshot)
+    counts = selfPlay(beads, games, Random(seed))
+    changed = array('l', (i for i in range(len(beads)) if beads[i] != snapshot[i]))
+    delta = array('l', (beads[i] - snapshot[i] for i in changed))
+    return changed, delta, counts
+
+def train(rounds, workers = None, sync = 1000, seed = 0, quiet = False, beads = None, evaluator = None):
+    """Play rounds bot v bot games over workers processes, returns beads"""
+    workers = workers or os.cpu_count()
+    print(f"Training {rounds} rounds on {workers} workers, merging every {sync} games each  Go!")
+    beads = initialBeads() if beads is None else array('l', beads)
+    totals = [0, 0, 0]
+    played = 0
+    merges = 0
+    from multiprocessing import Pool # Only parallel training needs processes
+    with Pool(workers) as pool:
+        while played < rounds:
+            games = [min(sync, max(0, rounds - played - w*sync)) for w in range(workers)]
+            tasks = [(beads, n, (seed << 32) + merges*workers + w) for w, n in enumerate(games) if n]
+            for changed, delta, counts in pool.imap(trainWorker, tasks):
+                for i, d in zip(changed, delta):
+                    beads[i] = max(0, beads[i] + d)
+                totals = [t + c for t, c in zip(totals, counts)]
+            played += sum(games)
+            merges += 1
+            if evaluator:
+                evaluator.update(played, beads)
             if not quiet:
-                print("O won!")
-                printBoard(intToBoard(board))
-            results.append(2)
-            # Remove 1 bead of all choices
-            for x in Xmoves:
-                b, pos = x
-                if b not in boards:
-                    addMatchbox(b, boards)
-                boards[b].beadsX.remove(pos)
-            # Add 3 beads to all choices
-            for o in Omoves:
-                b, pos = o
-                if b not in boards:
-                    addMatchbox(b, boards)
-                boards[b].beadsO.append(pos)
-                boards[b].beadsO.append(pos)
-                boards[b].beadsO.append(pos)
-        box0Beads.append(len(boards[0].beadsX))
-        nb.append(len(boards))
-        box1 = 0
-        for i in box1s:
-            if i not in boards:
-                addMatchbox(i, boards)
-            box1 += len(boards[i].beadsO)
-        box1Beads.append(box1)
-    plot(box0Beads, box1Beads)
-    plotBoards(nb)
+                print(f"Played: {played}, draws: {totals[0]}, X: {totals[1]}, O: {totals[2]}, beads: {sum(beads)}")
+    print(f"Draws: {totals[0]}, X won: {totals[1]}, O won: {totals[2]}")
+    return beads
+
+
+def simulate(rounds, batch = 1000, seed = 0, quiet = False, beads = None, evaluator = None):
+    """Play rounds bot v bot games with NumPy, batch games at a time in lockstep, returns beads
+
+    Every game in a batch draws from the same beads, like a train worker with sync = batch.
+    Each ply gathers box and symmetry for all state ids from the tables,
+    draws a bead per game by searching a random number in the box's cumulative counts,
+    and gathers the game result for the new state ids.
+    After the batch the rewards for every move are scatter added to the beads, clamped at 0"""
+    import numpy as np # Only the batch simulator needs numpy
+    print(f"Simulating {rounds} rounds {batch} at a time  Go!")
+    beads = initialBeads() if beads is None else beads
+    flat = np.array(beads, dtype=np.int64)
+    boxes = np.array(boxOf, dtype=np.intp)
+    syms = np.array(canonSym, dtype=np.intp)
+    perms = np.array(symmetries, dtype=np.intp)
+    powers = np.array(powers3, dtype=np.intp)
+    results = np.array([checkMasks(*boardMasks(canonBoard[sid])) for sid in range(nStates)], dtype=np.intp)
+    # Rows by GameResult, X reward and O reward
+    gains = np.zeros((4, 2), dtype=np.int64)
+    for state, reward in rewards.items():
+        gains[state] = reward
+    rng = np.random.default_rng(seed)
+    totals = np.zeros(4, dtype=np.int64)
+    played = 0
+    while played < rounds:
+        G = min(batch, rounds - played)
+        sid = np.zeros(G, dtype=np.intp)
+        state = np.zeros(G, dtype=np.intp)
+        moves = np.full((9, G), -1, dtype=np.intp) # Bead index 9*box + matchbox position per ply
+        counts = flat.reshape(-1, 9)
+        for ply in range(9):
+            live = np.flatnonzero(state == GameResult.PLAY)
+            if not len(live):
+                break
+            box = boxes[sid[live]]
+            cum = counts[box].cumsum(1)
+            out = cum[:, -1] == 0 # Out of beads, resign
+            state[live[out]] = resigned[ply % 2]
+            live, box, cum = live[~out], box[~out], cum[~out]
+            c = (cum <= rng.random(len(live))[:, None] * cum[:, -1:]).sum(1)
+            moves[ply, live] = 9*box + c
+            sid[live] += (1 + ply % 2) * powers[perms[syms[sid[live]], c]]
+            state[live] = results[sid[live]]
+        for ply in range(9):
+            made = moves[ply] >= 0
+            np.add.at(flat, moves[ply, made], gains[state[made], ply % 2])
+        np.maximum(flat, 0, out=flat)
+        totals += np.bincount(state, minlength=4)
+        played += G
+        if evaluator and evaluator.due(played):
+            evaluator.update(played, array('l', flat.tolist()))
+        if not quiet:
+            print(f"Played: {played}, draws: {totals[1]}, X: {totals[2]}, O: {totals[3]}, beads: {flat.sum()}")
+    print(f"Draws: {totals[1]}, X won: {totals[2]}, O won: {totals[3]}")
+    return array('l', flat.tolist())
 
 
+"""
+Perfect play
+Minimax over the matchbox boards, the transposition table is the dense box ids.
+For each box the value for the player to move, 1 win 0 draw -1 loss,
+and a 9 bit mask of the matchbox positions that keep that value.
+Saved once next to this file in the save file layout, b'MENP' with the box count,
+then a byte value + 1 and a uint16 mask per box
+"""
+perfectFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'menacePerfect.bin')
+perfectMagic = b'MENP'
+perfectValue = None
+perfectMoves = None
+
+def solvePerfect():
+    """Minimax every box, returns (values, best move masks)"""
+    values = array('b', [0]) * len(boxBoards)
+    moves = array('H', [0]) * len(boxBoards)
+    done = bytearray(len(boxBoards))
+    def solve(box):
+        if done[box]:
+            return values[box]
+        number = boxBoards[box]
+        xMask, oMask = boardMasks(number)
+        xTurn = bin(xMask).count('1') == bin(oMask).count('1')
+        best = -2
+        for pos in range(9):
+            if (xMask | oMask) >> pos & 1:
+                continue
+            if xTurn:
+                child = number | 3 << (2*pos)
+                result = checkMasks(xMask | 1 << pos, oMask)
+            else:
+                child = number | 2 << (2*pos)
+                result = checkMasks(xMask, oMask | 1 << pos)
+            if result == GameResult.PLAY:
+                v = -solve(boxOf[stateId(child)])
+            else:
+                v = 0 if result == GameResult.DRAW else 1 # Only the mover can finish a line
+            if v > best:
+                best = v
+                moves[box] = 0
+            if v == best:
+                moves[box] |= 1 << pos
+        values[box] = best
+        done[box] = 1
+        return best
+    solve(0)
+    return values, moves
+
+def loadPerfect(path = perfectFile):
+    """Fill perfectValue and perfectMoves from path, solving and saving it first if needed"""
+    global perfectValue, perfectMoves
+    if perfectValue is not None:
+        return
+    buildTables()
+    count = len(boxBoards)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, _, n = saveHeader.unpack_from(data)
+        if magic != perfectMagic or version != saveVersion or n != count:
+            raise ValueError(f"{path} is out of date")
+        values = array('b', (v - 1 for v in data[saveHeader.size:saveHeader.size + count]))
+        moves = array('H', data[saveHeader.size + count:saveHeader.size + 3*count])
+        if sys.byteorder != 'little':
+            moves.byteswap()
+    except (OSError, ValueError, struct.error):
+        values, moves = solvePerfect()
+        out = array('H', moves)
+        if sys.byteorder != 'little':
+            out.byteswap()
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(saveHeader.pack(perfectMagic, saveVersion, 0, count))
+                f.write(bytes(v + 1 for v in values))
+                out.tofile(f)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass # Read only, solving again next time is quick enough
+    perfectValue, perfectMoves = values, moves
+
+def perfectChoose(sid, xMask, oMask, rng = None):
+    """A random best minimax move for state id sid, as a play board position"""
+    loadPerfect()
+    mask = perfectMoves[boxOf[sid]]
+    c = (rng or random).choice([pos for pos in range(9) if mask >> pos & 1])
+    return symmetries[canonSym[sid]][c]
+
+def randomChoose(sid, xMask, oMask, rng = None):
+    """Any open position"""
+    taken = xMask | oMask
+    return (rng or random).choice([pos for pos in range(9) if not taken >> pos & 1])
+
+opponents = {PlayerType.PERFECT: perfectChoose, PlayerType.RANDOM: randomChoose}
+
+"""
+Evaluation
+Frozen beads play as X and as O against each opponent, nothing is learned.
+Results are (wins, draws, losses) for menace
+"""
+def evaluate(beads, opponent, games = 1000, menaceX = True, rng = None):
+    """Play games with beads against opponent, a choose function like perfectChoose"""
+    buildTables()
+    rng = rng or Random()
+    counts = [0, 0, 0]
+    players = (menaceChooser(beads), opponent) if menaceX else (opponent, menaceChooser(beads))
+    for _ in range(games):
+        state = runGame(players, rng)[0]
+        if state == GameResult.DRAW:
+            counts[1] += 1
+        elif (state == GameResult.X) == menaceX:
+            counts[0] += 1
+        else:
+            counts[2] += 1
+    return counts
+
+def evaluateAll(beads, games = 1000, seed = 0):
+    """Results for menace as X and O against perfect and random play"""
+    rng = Random(seed)
+    return {f"{name} {side}": evaluate(beads, opponents[player], games, side == 'X', rng)
+            for name, player in (('perfect', PlayerType.PERFECT), ('random', PlayerType.RANDOM))
+            for side in 'XO'}
+
+def formatEvaluation(played, results):
+    """1 line of win/draw/loss percents from evaluateAll results"""
+    line = f"Eval at {played}:"
+    for name, (w, d, l) in results.items():
+        n = w + d + l
+        line += f"  {name} {100*w/n:.0f}/{100*d/n:.0f}/{100*l/n:.0f}%"
+    return line + "  win/draw/loss"
+
+class Evaluator:
+    """Evaluates bead snapshots every few games in a background process so training keeps going
+
+    update is called with the games played so far, printed results are in order,
+    results holds (played, evaluateAll results) once finish returns"""
+    def __init__(self, every = 10000, games = 1000, seed = 0):
+        self.every = every
+        self.games = games
+        self.seed = seed
+        self.next = every
+        self.pool = None
+        self.pending = []
+        self.results = []
+
+    def due(self, played):
+        return played >= self.next
+
+    def update(self, played, beads):
+        if self.due(played):
+            if self.pool is None:
+                loadPerfect() # Solved and saved once before the worker starts
+                from multiprocessing import Pool
+                self.pool = Pool(1)
+            task = self.pool.apply_async(evaluateAll, (array('l', beads), self.games, self.seed + played))
+            self.pending.append((played, task))
+            self.next = (played // self.every + 1) * self.every
+        self.report()
+
+    def report(self, wait = False):
+        while self.pending and (wait or self.pending[0][1].ready()):
+            played, task = self.pending.pop(0)
+            self.results.append((played, task.get()))
+            print(formatEvaluation(*self.results[-1]))
+
+    def finish(self):
+        self.report(wait=True)
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        return self.results
+
+def learn(rounds, A = PlayerType.BOT, B = PlayerType.BOT, workers = 0, sync = 1000, batch = 0, seed = None,
+          load = None, save = None, metrics = None, every = 1, quiet = True, evalEvery = 0, evalGames = 1000,
+          checkpoint = None, checkpointEvery = 10000, resume = False):
+    """Train menace without graphs, for use as a library, returns beads
+
+    batch uses simulate, workers uses train, otherwise play.
+    load and save are bead file paths, metrics is a CSV path for play.
+    seed makes play repeatable too, train and simulate use 0 without it.
+    evalEvery games the beads are evaluated against perfect and random play, see Evaluator.
+    checkpoint, checkpointEvery and resume are for play, see play"""
+    if every < 1 or checkpointEvery < 1 or evalEvery < 0:
+        raise ValueError("every and checkpointEvery have to be at least 1, evalEvery 0 or more")
+    if seed is not None and not (batch or workers):
+        random.seed(seed)
+    seed = seed or 0
+    evaluator = Evaluator(evalEvery, evalGames, seed) if evalEvery else None
+    beads = loadBeads(load) if load else None
+    if load and not quiet:
+        print(f"Loaded {len(beads)//9} boxes")
+    if batch:
+        beads = simulate(rounds, batch, seed, quiet, beads, evaluator)
+    elif workers:
+        beads = train(rounds, workers, sync, seed, quiet, beads, evaluator)
+    else:
+        beads = play(A, B, rounds, quiet, beads=beads, metrics=metrics, every=every, evaluator=evaluator,
+                     checkpoint=checkpoint, checkpointEvery=checkpointEvery, resume=resume)
+    if evaluator:
+        evaluator.finish()
+    if save:
+        saveBeads(save, beads)
+    return beads
+
+"""
+Startup benchmark
+Times a fresh python importing menace and a fresh python training 100 games,
+best of repeats, so short jobs stay quick to start
+"""
+startupRuns = {
+    'import': [sys.executable, '-c', 'import menace'],
+    'train100': [sys.executable, '-c', 'import menace; menace.learn(100)'],
+}
+
+def benchmarkStartup(repeats = 5):
+    """Best and mean seconds for each startupRuns command, returns a dict ready for json"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {'python': sys.version.split()[0], 'repeats': repeats}
+    for name, command in startupRuns.items():
+        times = []
+        for _ in range(repeats):
+            p0 = perf_counter()
+            subprocess.run(command, cwd=here, check=True, stdout=subprocess.DEVNULL)
+            times.append(perf_counter() - p0)
+        results[name] = {'best': min(times), 'mean': sum(times) / len(times)}
+    return results
+
+def printStartup(results, old = None):
+    """Print startup times, with old results the change from them too"""
+    for name in startupRuns:
+        line = f"{name:<10} best {results[name]['best']*1000:8.1f}ms  mean {results[name]['mean']*1000:8.1f}ms"
+        if old and name in old:
+            line += f"  was {old[name]['best']*1000:8.1f}ms  x{old[name]['best'] / results[name]['best']:.2f}"
+        print(line)
+
+
+
+
+# Options followed by a value, so a number after them isn't the rounds
+valueOptions = ('--plot', '--startup', '--repeat', '--compare', '--evaluate', '--eval-games', '--seed',
+                '--checkpoint', '--checkpoint-every', '--batch', '--metrics', '--every', '-j', '--sync',
+                '--load', '--save', '--eval', '--rounds')
+
+def getRounds():
+    """Rounds from --rounds or a trailing number that isn't an option value, None if neither"""
+    if '--rounds' in sys.argv:
+        return getArg('--rounds')
+    if len(sys.argv) > 1 and sys.argv[-2] not in valueOptions:
+        try:
+            return int(sys.argv[-1])
+        except ValueError:
+            pass
+    return None
+
+def getArg(name, default = None, kind = int):
+    """Value after name in sys.argv, default when it isn't there"""
+    if name in sys.argv:
+        return kind(sys.argv[sys.argv.index(name) + 1])
+    return default
 
 
 if __name__ == "__main__":
-    import sys
+    if '--plot' in sys.argv:
+        import menacePlot
+        menacePlot.plotMetrics(getArg('--plot', kind=str))
+        sys.exit()
+    if '--startup' in sys.argv:
+        results = benchmarkStartup(getArg('--repeat', 5))
+        old = None
+        if '--compare' in sys.argv:
+            with open(getArg('--compare', kind=str)) as f:
+                old = json.load(f)
+        printStartup(results, old)
+        with open(getArg('--startup', kind=str), 'w') as f:
+            json.dump(results, f, indent=1)
+        sys.exit()
+    if '--evaluate' in sys.argv:
+        beads = loadBeads(getArg('--evaluate', kind=str))
+        print(formatEvaluation('load', evaluateAll(beads, getArg('--eval-games', 1000), getArg('--seed', 0))))
+        sys.exit()
     quiet = False
     if '-q' in sys.argv:
         quiet = True
         print("Quiet!")
-    p1, p2, rounds = 2,2,400
-    try:
-        rounds = int(sys.argv[-1])
-    except:
+    resume = '--resume' in sys.argv
+    checkpoint = getArg('--checkpoint', 'menace.ckpt' if resume else None, str)
+    p1, p2 = 2,2
+    rounds = getRounds()
+    if rounds is None and not resume: # Resuming takes rounds from the checkpoint
         p1, p2, rounds = prompt()
-    play(p1, p2, rounds, quiet)
+    batch = getArg('--batch', 1000) if '--numpy' in sys.argv else 0
+    metrics = None if batch or '-j' in sys.argv else getArg('--metrics', 'menace.csv', str)
+    if resume:
+        metrics = loadCheckpoint(checkpoint)[1]['metrics']
+    learn(rounds, p1, p2, getArg('-j', 0), getArg('--sync', 1000), batch, getArg('--seed', kind=int),
+          getArg('--load', kind=str), getArg('--save', kind=str), metrics, getArg('--every', 1), quiet,
+          getArg('--eval', 0), getArg('--eval-games', 1000),
+          checkpoint, getArg('--checkpoint-every', 10000), resume)
+    if metrics and '--no-plot' not in sys.argv:
+        import menacePlot # Only graphs need matplotlib
+        menacePlot.plotMetrics(metrics)
@@ -0,0 +1,197 @@
+#! python3
+
+"""
+Menace on m x n boards with k in a row
+
+Same matchboxes and beads as menace.py, which keeps its fast 3x3 only tables.
+Here nothing is listed up front, a state space like 4x4 is far too big for that.
+
+Board is 2 bitmasks, bit r*n + c set for each X or O.
+The state key is xMask | oMask << cells, a python int so boards past 64 bits work too.
+Symmetries are permutation tables, generated by rotating and mirroring until no new ones turn up,
+4 for rectangles and 8 for squares, c[i] = b[perm[i]] like menace.symmetries.
+Permuting a key goes a byte at a time through a table per symmetry.
+
+The matchbox board is the smallest key of all the symmetries.
+Matchboxes are made the first time a game reaches them,
+index maps a matchbox key to a box id and beads holds cells counts per box in 1 flat array
+
+python menaceMNK.py 4 4 3 100000
+python menaceMNK.py --benchmark 20000
+"""
+
+import sys
+from random import Random
+from array import array
+from time import perf_counter
+
+from menace import GameResult, rewards, startingBeads
+
+
+class Game:
+    """MENACE self play on m rows by n columns, k in a row wins"""
+    __slots__ = ('m', 'n', 'k', 'cells', 'lines', 'linesAt', 'perms', 'tables', 'index', 'beads', 'rng')
+    def __init__(self, m = 3, n = 3, k = 3, seed = None):
+        if not 0 < k <= max(m, n):
+            raise ValueError(f"Can't get {k} in a row on {m}x{n}")
+        self.m, self.n, self.k = m, n, k
+        self.cells = m * n
+        self.lines = self.getLines()
+        self.linesAt = [[w for w in self.lines if w >> pos & 1] for pos in range(self.cells)]
+        self.perms = self.getSymmetries()
+        self.tables = [self.chunkTable(perm) for perm in self.perms]
+        self.index = {} # Matchbox key to box id
+        self.beads = array('I')
+        self.rng = Random(seed)
+
+    def getLines(self):
+        """Bitmasks of every k in a row, across, down and both diagonals"""
+        m, n, k = self.m, self.n, self.k
+        lines = []
+        for r in range(m):
+            for c in range(n):
+                for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    if 0 <= r + dr*(k-1) < m and 0 <= c + dc*(k-1) < n:
+                        lines.append(sum(1 << ((r + dr*i)*n + c + dc*i) for i in range(k)))
+        return lines
+
+    def getSymmetries(self):
+        """Every rotation and mirror as a permutation, identity first"""
+        m, n = self.m, self.n
+        cells = range(self.cells)
+        generators = [tuple((m-1 - i//n)*n + i%n for i in cells), # Flip rows
+                      tuple(i//n*n + n-1 - i%n for i in cells)] # Flip columns
+        if m == n:
+            generators.append(tuple((n-1 - i%n)*n + i//n for i in cells)) # Rotate
+        perms = [tuple(cells)]
+        k = 0
+        while k < len(perms):
+            for g in generators:
+                p = tuple(perms[k][g[i]] for i in cells)
+                if p not in perms:
+                    perms.append(p)
+            k += 1
+        return perms
+
+    def chunkTable(self, perm):
+        """Per byte of a key, the permuted bits for each of the 256 byte values"""
+        cells = self.cells
+        inverse = [0] * cells
+        for i, p in enumerate(perm):
+            inverse[p] = i
+        to = inverse + [i + cells for i in inverse] # X bits then O bits
+        table = []
+        for start in range(0, 2*cells, 8):
+            bits = [1 << to[j] for j in range(start, min(start + 8, 2*cells))]
+            chunk = [0] * 256
+            for v in range(1, 256):
+                low = v & -v
+                chunk[v] = chunk[v ^ low] | (bits[low.bit_length() - 1] if low.bit_length() <= len(bits) else 0)
+            table.append(chunk)
+        return table
+
+    def canonical(self, key):
+        """Matchbox key and index into perms that turns key into it"""
+        best = None
+        for s, table in enumerate(self.tables):
+            k = 0
+            rest = key
+            for chunk in table:
+                k |= chunk[rest & 255]
+                rest >>= 8
+            if best is None or k < best:
+                best = k
+                sym = s
+        return best, sym
+
+    def getBox(self, key):
+        """Box id for a matchbox key, made with startingBeads on open positions the first time"""
+        box = self.index.get(key)
+        if box is None:
+            box = self.index[key] = len(self.index)
+            taken = key | key >> self.cells
+            self.beads.extend(0 if taken >> pos & 1 else startingBeads for pos in range(self.cells))
+        return box
+
+    def check(self, xMask, oMask, pos):
+        """Game result after a move at pos, the same open line draw rule as menace.checkMasks"""
+        xMoved = xMask >> pos & 1
+        mover = xMask if xMoved else oMask
+        for w in self.linesAt[pos]:
+            if mover & w == w:
+                return GameResult.X if xMoved else GameResult.O
+        for w in self.lines:
+            if not (xMask & w and oMask & w):
+                return GameResult.PLAY
+        return GameResult.DRAW
+
+    def selfPlay(self, games):
+        """Play games bot v bot updating beads, returns counts of (draws, X wins, O wins)"""
+        cells = self.cells
+        beads = self.beads
+        counts = [0, 0, 0]
+        for _ in range(games):
+            xMask = 0
+            oMask = 0
+            moves = ([], []) # X, O bead index
+            turn = 0
+            state = GameResult.PLAY
+            while state == GameResult.PLAY:
+                key, sym = self.canonical(xMask | oMask << cells)
+                start = self.getBox(key) * cells
+                weights = beads[start:start+cells]
+                if not any(weights): # Out of beads, resign
+                    state = GameResult.X if turn else GameResult.O
+                    break
+                c = self.rng.choices(range(cells), weights)[0]
+                moves[turn].append(start + c)
+                pos = self.perms[sym][c]
+                if turn:
+                    oMask |= 1 << pos
+                else:
+                    xMask |= 1 << pos
+                state = self.check(xMask, oMask, pos)
+                turn ^= 1
+            for side, reward in zip(moves, rewards[state]):
+                for i in side:
+                    beads[i] = max(0, beads[i] + reward)
+            counts[state - 1] += 1
+        return counts
+
+    def memory(self):
+        """Bytes held by the matchbox index and beads"""
+        size = sys.getsizeof(self.index) + sum(sys.getsizeof(key) for key in self.index)
+        return size + self.beads.buffer_info()[1] * self.beads.itemsize
+
+
+def benchmark(games = 20000, sizes = ((3, 3, 3), (4, 4, 4), (4, 4, 3)), seed = 0):
+    """Self play games on each m, n, k, returns rows of games per second and memory"""
+    rows = []
+    for m, n, k in sizes:
+        game = Game(m, n, k, seed)
+        p0 = perf_counter()
+        counts = game.selfPlay(games)
+        seconds = perf_counter() - p0
+        rows.append({'size': f"{m}x{n}x{k}", 'games': games, 'gamesPerSecond': games / seconds,
+                     'boxes': len(game.index), 'bytes': game.memory(), 'results': counts})
+    return rows
+
+def printBenchmark(rows):
+    print(f"{'size':<8}{'games/s':>10}{'boxes':>10}{'memory':>12}{'bytes/box':>11}  draws/X/O")
+    for r in rows:
+        print(f"{r['size']:<8}{r['gamesPerSecond']:>10.0f}{r['boxes']:>10}{r['bytes']/1e6:>10.1f}MB"
+              f"{r['bytes']/max(1, r['boxes']):>11.0f}  {'/'.join(map(str, r['results']))}")
+
+
+if __name__ == "__main__":
+    if '--benchmark' in sys.argv:
+        games = int(sys.argv[-1]) if sys.argv[-1] != '--benchmark' else 20000
+        printBenchmark(benchmark(games))
+        sys.exit()
+    m, n, k, rounds = (int(x) for x in sys.argv[1:5])
+    game = Game(m, n, k)
+    p0 = perf_counter()
+    draws, xWins, oWins = game.selfPlay(rounds)
+    print(f"{m}x{n} {k} in a row  {rounds} games in {perf_counter() - p0:.1f}s")
+    print(f"Draws: {draws}, X won: {xWins}, O won: {oWins}")
+    print(f"Boxes: {len(game.index)}, memory: {game.memory()/1e6:.1f}MB")
@@ -0,0 +1,59 @@
+#! python3
+
+"""
+Menace graphs
+Reads a metrics CSV written by menace.play, kept apart so training never imports matplotlib
+python menacePlot.py menace.csv
+"""
+
+import sys
+import csv
+import matplotlib
+matplotlib.use('Agg') # Only saves files, no window
+import matplotlib.pyplot as plt
+
+
+def readMetrics(path):
+    """Columns of a metrics CSV as a dict of lists of ints"""
+    with open(path, newline='') as f:
+        rows = csv.reader(f)
+        header = next(rows)
+        columns = {name: [] for name in header}
+        for row in rows:
+            for name, v in zip(header, row):
+                columns[name].append(int(v))
+    return columns
+
+def plot(games, X, O):
+    plt.subplots()
+    zero = X[0]
+    y = [b-zero for b in X]
+    plt.plot(games, y, 'bx', label='X')
+    zero = O[0]
+    y = [b-zero for b in O]
+    plt.plot(games, y, 'ro', label='O')
+    plt.legend()
+    plt.title("Menace")
+    plt.ylabel("beads 3xwin + draws - loses")
+    plt.xlabel("games")
+    plt.savefig('menace.png')
+
+def plotBoards(games, n):
+    plt.subplots()
+    plt.plot(games, n, 'b.', label='Boards')
+    plt.title("Menace Symmetry Reduced Boards Played On")
+    plt.ylabel("Boards")
+    plt.xlabel("Games")
+    plt.savefig('menaceboards.png')
+
+def plotMetrics(path):
+    """Make the menace.png and menaceboards.png graphs from a metrics CSV"""
+    m = readMetrics(path)
+    if not m['game']:
+        return
+    plot(m['game'], m['box0'], m['box1'])
+    plotBoards(m['game'], m['boards'])
+
+
+if __name__ == "__main__":
+    plotMetrics(sys.argv[1] if len(sys.argv) > 1 else 'menace.csv')
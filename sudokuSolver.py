@@ -1,5 +1,6 @@
 """
 Sudoku Solver
+    Rules and search live in constraintSolver, shared with kenken
 
 How many ways to solve?
 1. Brute Force (Iterative?)
@@ -13,44 +14,66 @@ How many ways to solve?
     Train a neural network to play?
     81 input neurons a few hidden layers 81 output neurons
     Signals 0-9 input and 1-9 output... hopefully
+
+Killer Sudoku
+    No givens, cages of cells that add up to a total and can't repeat a number
 """
 
 from math import isqrt
 from time import perf_counter
-
-
-"""OOP Monster"""
-class Cell:
-    def __init__(self, number = 0, fixed = False):
-        self.number = number
-        self.possible = [x for x in range(1, 10) if self.number == 0]
-        self.fixed = fixed
-    def isSet(self):
-        return self.fixed or (self.number != 0)
-
-class Block:
-    def __init__(self, cells = []):
-        self.cells = cells[:]
-        while len(self.cells) < 9:
-            self.cells.append(Cell(0))
-
-class Board:
+from functools import lru_cache
+
+from constraintSolver import Model, AllDifferent, Cage, numbersIn
+
+
+def getBlockIndicesFlat(blockX, blockY, sudokuGrid = 9):
+    """Return list of indices in a sudoku block.
+
+    block X,Y indices start from 0
+    Max grid X,Y is sqrt(sudokuGrid) - 1
+    For 9x9 sudoku, flat indexing is 0-80 in list of sudoku board
+    e.g. Block 0,0 should return [0, 1, 2, 9, 10, 11, 18, 19, 20]
+         0  1  2
+         9 10 11
+        18 19 20
+    """
+    blockSize = isqrt(sudokuGrid) # TODO Check for bad grid
+    indices = []
+    row0 = blockX * blockSize # 0, 1, 2 -> 0, 3, 6
+    col0 = blockY * blockSize
+    for row in range(row0, row0 + blockSize):
+        for col in range(col0, col0 + blockSize):
+            indices.append(row * sudokuGrid + col)
+    return indices
+
+@lru_cache(maxsize=None)
+def getUnits(sudokuGrid = 9):
+    """AllDifferent rules for every row, column and block, shared by every board"""
+    N = sudokuGrid
+    k = isqrt(N)
+    rows = [AllDifferent(range(r*N, (r+1)*N)) for r in range(N)]
+    cols = [AllDifferent(range(c, N*N, N)) for c in range(N)]
+    blocks = [AllDifferent(getBlockIndicesFlat(x, y, N)) for x in range(k) for y in range(k)]
+    return tuple(rows + cols + blocks)
+
+
+class Board(Model):
     """ Sudoku Board
-    Handles everything...
 
-    numbers - list of lists holding numbers in each row & col
-    possible - lists 3 deep holding all numbers that could be in a cell or empty if it's a given number"""
+    A Model with flat arrays indexed by row * 9 + col,
+    rows, columns and blocks are AllDifferent
+
+    numbers - bytearray of set numbers, 0 is empty
+    possible - bitmasks of numbers that could be in a cell, see numbersIn"""
+    __slots__ = ()
     def __init__(self, numbers = []):
-        self.numbers = [row[:] for row in numbers]
-        self.possible = []
-        for row in self.numbers:
-            self.possible.append([])
-            for n in row:
-                if n == 0:
-                    self.possible[-1].append([x for x in range(1, 10)])
-                else: # Empty list
-                    self.possible[-1].append([])
-        self.stack = []
+        """numbers is a list of 9 rows, 0 is empty"""
+        super().__init__(81, 9)
+        for unit in getUnits():
+            self.add(unit)
+        for i, n in enumerate(n for row in numbers for n in row):
+            if n:
+                self.setNumber(i, n)
 
     def __str__(self):
         """Print pretty square
@@ -60,10 +83,10 @@ class Board:
         s = ""
         s += '.' + '-' * (width - 2) + '.\n'
         sep = '|' + '-------+'*2 + '-------|\n'
-        for i, row in enumerate(self.numbers):
+        for i in range(9):
             if (i != 0) and (i%3 == 0):
                 s += sep
-            for j, n in enumerate(row):
+            for j, n in enumerate(self.getRow(i)):
                 if j%3 == 0:
                     s += '| '
                 s += '{0} '.format(n)
@@ -72,68 +95,25 @@ class Board:
         return s
 
     def getRow(self, index):
-        return self.numbers[index]
+        return list(self.numbers[index*9:index*9+9])
 
     def getRowPossible(self, index):
-        return self.possible[index]
+        return [list(numbersIn(m)) for m in self.possible[index*9:index*9+9]]
 
     def getColumn(self, index):
-        return [x[index] for x in self.numbers]
+        return list(self.numbers[index::9])
 
     def getColumnPossible(self, index):
-        return [x[index] for x in self.possible]
+        return [list(numbersIn(m)) for m in self.possible[index::9]]
 
     def getBlock(self, x, y):
         """Return 3x3 grid x, y from 0 to 2"""
-        block = []
-        for rows in range(y*3, y*3+3):
-            for col in range(x*3, x*3+3):
-                block.append(self.numbers[rows][col])
-        return block
+        return [self.numbers[i] for i in getBlockIndicesFlat(y, x)]
 
     def getBlockPossible(self, x, y):
         """Return 3x3 grid x, y from 0 to 2"""
-        block = []
-        for rows in range(y*3, y*3+3):
-            block.append([])
-            for col in range(x*3, x*3+3):
-                block[-1].append(self.possible[rows][col])
-        return block
-
-    def validNumberInRow(self, number, index):
-        return number not in self.numbers[index]
-    
-    def validNumberInColumn(self, number, index):
-        return number not in self.getColumn(index)
-
-    def validNumberInBlock(self, number, x, y):
-        return number not in self.getBlock(x, y)
-
-    def isValidNumber(self, num, row, col):
-        return self.validNumberInRow(num, row) \
-            and self.validNumberInColumn(num, col) \
-            and self.validNumberInBlock(num, col//3, row//3)
-
-    def backtrack(self, num, cellIndex):
-        r,c = cellIndex//9, cellIndex%9
-        if r > 8:
-            return True
-        while self.numbers[r][c] != 0:
-            cellIndex += 1
-            r,c = cellIndex//9, cellIndex%9
-            if r > 8:
-                return True # Every cell filled
-        for num in range(num, 10):
-            if not self.isValidNumber(num, r, c):
-                continue
-            self.numbers[r][c] = num
-            print(self)
-            if not self.backtrack(1, cellIndex + 1):
-                continue
-            else:
-                return True
-        self.numbers[r][c] = 0 # Backtrack
-        return False
+        indices = getBlockIndicesFlat(y, x)
+        return [[list(numbersIn(self.possible[i])) for i in indices[r:r+3]] for r in range(0, 9, 3)]
 
     def printPossible(self):
         """Print possible numbers
@@ -155,16 +135,15 @@ class Board:
         s = ""
         sep1 = (' '*12 + '| ')*2 + ' '*11 + '\n'
         sep2 = sep1.replace(' ', '-').replace('|', '+')
-        for i, row in enumerate(self.possible):
+        for i in range(9):
             if (i != 0) and (i%3 == 0):
                 s += sep2
             for j in range(3): # 1 4 7
-                for k, n in enumerate(row):
+                for k, m in enumerate(self.possible[i*9:i*9+9]):
                     if (k != 0) and (k%3 == 0):
                         s += '| '
-                    x = [x for x in range((j*3)+1, (j*3)+4)]
-                    for l in x:
-                        if l in n:
+                    for l in range((j*3)+1, (j*3)+4):
+                        if m >> l & 1:
                             s += str(l)
                         else:
                             s += ' '
@@ -173,304 +152,16 @@ class Board:
             s += sep1
         print(s)
 
-    def printPossibleBlock(self, x, y, sudokuGrid = 9):
-        """
-
-        Indices
-        1 2 3 \n
-        4 5 6 \n
-        7 8 9
-
-        For each index row
-        123 123 123 \n
-        """
-        indices = self.getBlockIndices(x, y)
-        #print(indices, len(indices))
-        # Indices are row by row
-        blockSize = isqrt(sudokuGrid)
-        #print("size", blockSize)
-        s = ""
-        for row in range(blockSize): # 0, 3, 6
-            rIndex = row * blockSize
-            for j in range(blockSize): # minirow/col
-                for col in range(blockSize): # 1 2 3 /n
-                    index = rIndex + col
-                    #print("Index", index)
-                    #print("\t", indices[index])
-                    r,c = indices[index]
-                    p = self.possible[r][c]
-                    x = [x for x in range((j*3)+1, (j*3)+4)]
-                    for l in x:
-                        if l in p:
-                            s += str(l)
-                        else:
-                            s += ' '
-                    s += ' '
-                s += '\n'
-            s += '\n'
-        print(s)
-
+class KillerBoard(Board):
+    """Killer Sudoku Board
 
-    def updatePossible(self):
-        """Remove set on board numbers from possible lists
-
-        Returns number of changed cells"""
-        changes = 0
-        for i in range(81):
-            r = i // 9
-            c = i % 9
-            n = self.numbers[r][c]
-            if n == 0:
-                continue
-            # Clear row
-            for j in self.possible[r]:
-                if len(j) == 1:
-                    continue
-                if n in j:
-                    j.remove(n)
-                    changes += 1
-            # Clear column
-            for row in self.possible:
-                if len(row[c]) == 1:
-                    continue
-                if n in row[c]:
-                    row[c].remove(n)
-                    changes += 1
-            # Clear block
-            r0 = r - r%3
-            c0 = c - c%3
-            for row in range(r0, r0+3):
-                for col in range(c0, c0+3):
-                    cell = self.possible[row][col]
-                    if len(cell) > 1 and n in cell:
-                        cell.remove(n)
-                        changes += 1
-        return changes
-
-    def trySetBoard(self):
-        """Look for possible numbers lists with only 1 option
-
-        Return number of changes"""
-        changes = 0
-        for r in range(9):
-            for c in range(9):
-                p = self.possible[r][c]
-                n = self.numbers[r][c]
-                if not p and n == 0:
-                    raise RuntimeError("The programmer is an idiot, let him know he messed up.")
-                elif len(p) == 1 and n == 0:
-                    self.numbers[r][c] = p.pop()
-                    changes += 1
-                elif len(p) == 1 and n != 0:
-                    if n == p[0]:
-                        p.pop()
-                    else:
-                        print("Problem at {} {}".format(r, c))
-                else:
-                    pass # many possible, hopefully n is 0...
-        return changes
-
-    def removeFromRow(self, num, rowIndex, exclude = []):
-        changes = 0
-        for i,c in enumerate(self.possible[rowIndex]):
-            if i in exclude:
-                continue
-            if num in c:
-                c.remove(num)
-                changes += 1
-        return changes
-
-    def removeFromCol(self, num, colIndex, exclude = []):
-        changes = 0
-        for i,r in enumerate([row[colIndex] for row in self.possible]):
-            if i in exclude:
-                continue
-            # r is list so this is a reference
-            if num in r:
-                r.remove(num)
-                changes += 1
-        return changes
-
-    def getBlockIndicesForCell(self, row, col, sudokuGrid = 9):
-        """Return list of (row, col) indices for a block
-
-        Give a cell and return the block it belongs to
-        by calling getBlockIndices
-        """
-        blockX = (row // sudokuGrid) + 1 # 0 to 8 -> 0 + 1
-        blockY = (col // sudokuGrid) + 1
-        return self.getBlockIndices(blockX, blockY, sudokuGrid)
-
-    def getBlockIndices(self, blockX, blockY, sudokuGrid = 9):
-        """Return list of (row, col) indices in a block
+    A sudoku board plus sum Cages, numbers can't repeat in a cage either
+    cages is a list of (total, [cell indices])"""
+    __slots__ = ('cages',)
+    def __init__(self, cages = [], numbers = []):
+        super().__init__(numbers)
+        self.cages = [self.add(Cage('+', total, cells, 9)) for total, cells in cages]
 
-        This is ambiguous indexing, so README
-        block X,Y indices start from 0 to match list 0 indexing
-        Max grid X,Y is sqrt(sudokuGrid)
-        """
-        blockSize = isqrt(sudokuGrid) # TODO Check for bad grid value (not even split 9,16,25)
-        indices = []
-        row0 = blockX * blockSize # 0, 1, 2 -> 0, 3, 6
-        col0 = blockY * blockSize
-        for row in range(row0, row0 + blockSize):
-            for col in range(col0, col0 + blockSize):
-                indices.append((row, col))
-        return indices
-
-
-    def getBlockIndicesFlat(self, blockX, blockY, sudokuGrid = 9):
-        """Return list of indices in a sudoku block.
-
-        block X,Y indices start from 0
-        Max grid X,Y is sqrt(sudokuGrid) - 1
-        For 9x9 sudoku, flat indexing is 0-80 in list of sudoku board
-        e.g. Block 0,0 should return [0, 1, 2, 9, 10, 11, 18, 19, 20]
-             0  1  2
-             9 10 11
-            18 19 20
-        """
-        blockSize = isqrt(sudokuGrid) # TODO Check for bad grid
-        indices = []
-        row0 = blockX * blockSize # 0, 1, 2 -> 0, 3, 6
-        col0 = blockY * blockSize
-        for row in range(row0, row0 + blockSize):
-            for col in range(col0, col0 + blockSize):
-                indices.append(row * sudokuGrid + col)
-        return indices
-
-    def removeFromBlock(self, num, blockX, blockY, exclude = []): # TODO Add sudokuGrid parameter everywhere?
-        """
-
-        NOTE: Expect exclude as tuples (row, col)
-        """
-        changes = 0
-        indices = self.getBlockIndices(blockX, blockY)
-        for c in indices:
-            if c in exclude:
-                continue
-            row, col = c
-            cell = self.possible[row][col]
-            if num in cell:
-                print(self.possible[row][col])
-                cell.remove(num)
-                changes += 1
-                print(self.possible[row][col])
-        return changes
-
-
-    def trimPairsAndTriplets(self, sudokuGrid = 9):
-        """
-
-        1. Just loop through looking for matches
-        2. Make lists of lengths to only look at others with same len
-            But there's only 9 items per list
-        """
-        changes = 0
-        # Rows
-        for rowIndex, r in enumerate(self.possible):
-            for i,c in enumerate(r):
-                if len(c) == 2:
-                    for j in range(i+1, len(r)):
-                        if c == r[j]:
-                            # Found a pair
-                            # Should be the only pair, else maybe unsolveable?
-                            for n in c:
-                                changes += self.removeFromRow(n, rowIndex, exclude=[i,j])
-                elif len(c) == 3:
-                    for j in range(i+1, len(r)):
-                        if c == r[j]:
-                            # Found a pair, need to find a 3rd
-                            for k in range(j+1, len(r)):
-                                if c == r[k]:
-                                    # Found triplet
-                                    for n in c:
-                                        changes += self.removeFromRow(n, rowIndex, exclude=[i,j,k])
-        # Columns
-        for colIndex in range(sudokuGrid):
-            for rowIndex in range(sudokuGrid):
-                c = self.possible[rowIndex][colIndex]
-                if len(c) == 2:
-                    for j in range(rowIndex+1, sudokuGrid):
-                        if c == self.possible[j][colIndex]:
-                            # Found a pair
-                            # Should be the only pair, else maybe unsolveable?
-                            for n in c:
-                                changes += self.removeFromCol(n, colIndex, exclude=[rowIndex,j])
-                elif len(c) == 3:
-                    for j in range(rowIndex+1, sudokuGrid):
-                        if c == self.possible[j][colIndex]:
-                            # Found a pair, need to find a 3rd
-                            for k in range(j+1, sudokuGrid):
-                                if c == self.possible[k][colIndex]:
-                                    # Found triplet
-                                    for n in c:
-                                        changes += self.removeFromCol(n, colIndex, exclude=[rowIndex,j,k])
-        # Blocks
-        nBlocks = isqrt(sudokuGrid)
-        #TODO General: Is one faster nested for loops or flat loop with x = i//dim1 y = i%dim2 maybe z = i//(dim1*dim2), etc...
-        for x in range(nBlocks):
-            for y in range(nBlocks):
-                indices = self.getBlockIndices(x, y, sudokuGrid)
-                # DEBUG print block
-                #print("Block",x,y)
-                bchange = 0
-                #self.printPossibleBlock(x, y)
-                for i in range(len(indices)):
-                    coordI = indices[i]
-                    r,c = indices[i]
-                    cell = self.possible[r][c]
-                    if len(cell) == 2:
-                        for j in range(i+1, len(indices)):
-                            coordJ = indices[j]
-                            rj, cj = indices[j]
-                            if cell == self.possible[rj][cj]:
-                                # Found a pair
-                                # Should be the only pair, else maybe unsolveable?
-                                for n in cell:
-                                    cha= self.removeFromBlock(n, x, y, exclude=[coordI, coordJ])
-                                    changes += cha
-                                    bchange += cha
-                    elif len(cell) == 3:
-                        for j in range(i+1, len(indices)):
-                            coordJ = indices[j]
-                            rj, cj = indices[j]
-                            if cell == self.possible[rj][cj]:
-                                # Found a pair, find 3rd
-                                for k in range(j+1, len(indices)):
-                                    coordK = indices[k]
-                                    rk, ck = indices[k]
-                                    if cell == self.possible[rk][ck]:
-                                        # Found triplet
-                                        for n in cell:
-                                            cha += self.removeFromBlock(n, x, y, exclude=[coordI, coordJ, coordK])
-                                            changes += cha
-                                            bchange += cha
-                #if bchange > 0:
-                #    print(bchange, 'changes')
-                #    self.printPossibleBlock(x, y)
-        return changes
-
-    def playerSolver(self):
-        """Try to solve sudoku like a player would.
-
-        Check rows, columns, and blocks to find/rule out number placement.
-        Use backtracking when we need to guess."""
-        currNumber = 1
-        flatBoard = [n for row in self.numbers for n in row]
-        self.updatePossible()
-        cycles = 0
-        changed = True
-        while changed:
-            print(self)
-            changed = False
-            self.printPossible()
-            changes = self.updatePossible()
-            changes += self.trimPairsAndTriplets()
-            changes += self.trySetBoard()
-            changed = changes > 0
-            cycles += 1
-            print("{} cycles".format(cycles), end='\r')
-        print("")
 
 def run():
     testBoard = [
@@ -494,23 +185,38 @@ def run():
     b.playerSolver()
     print(b)
     pT = perf_counter() - p0
+    guesses = b.guesses
     b0 = perf_counter()
     b = Board(testBoard)
     print(b)
-    b.printPossible()
     b.backtrack(1, 0)
     print(b)
     bT = perf_counter() - b0
-    print("PlaySolver", pT)
-    print("Backtrack", bT)
+    print("PlaySolver", pT, "guesses", guesses)
+    print("Backtrack", bT, "nodes", b.nodes)
     print("Backtrack blank")
     b0 = perf_counter()
-    b = Board([[0 for x in range(9)] for y in range(9)])
-    print(b)
+    b = Board()
     b.backtrack(1, 0)
     print(b)
     bT = perf_counter() - b0
     print("Backtrack", bT)
+    print("Killer")
+    killer = [
+        (18, [0,1,10]), (14, [2,11,20]), (18, [3,12,13]), (19, [4,5,14,23]),
+        (23, [6,7,8,15]), (10, [9,18]), (14, [16,25]), (7, [17,26]), (18, [19,27,28,37]),
+        (10, [21,30]), (6, [22]), (1, [24]), (16, [29,38,39]), (15, [31,40,49,58]),
+        (8, [32,41]), (13, [33,42,43]), (13, [34,35,44]), (17, [36,45,46]), (5, [47,56]),
+        (6, [48,57]), (14, [50,59,68]), (13, [51,52]), (21, [53,61,62]),
+        (16, [54,63,64,73]), (9, [55]), (20, [60,69,70]), (23, [65,66,75]),
+        (12, [67,76]), (3, [71,80]), (2, [72]), (6, [74]), (15, [77,78,79]),
+            ]
+    k0 = perf_counter()
+    b = KillerBoard(killer)
+    b.playerSolver()
+    print(b)
+    kT = perf_counter() - k0
+    print("PlaySolver", kT, "guesses", b.guesses, "solved", b.isSolved())
 
 
 
@@ -518,4 +224,3 @@ def run():
 if __name__ == "__main__":
     print("Howdy.")
     run()
-